@@ -1,11 +1,29 @@
-from fastapi import FastAPI, HTTPException, Query, Depends
-from typing import List, Optional
-from sqlalchemy.orm import Session as OrmSession
-from models import Contractor, Session
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Literal, Optional
+from sqlalchemy.orm import Session as OrmSession, sessionmaker
+import os
+import math
+from sqlalchemy import text, or_, and_, select, func, case, cast, Integer, event
+from models import (Contractor, Certification, contractor_certifications, Session, engine, has_spatial_index, SPATIAL_INDEX_TABLE,
+                    create_async_db_engine, get_data_version, PRIORITY_LEVELS)
+from stats import compute_stats, STATS_TOP_N
+import metrics
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.routing import Match
 import io
 import csv
+import json
+import base64
+import zlib
+import time
+import heapq
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict, namedtuple
+from datetime import datetime
 
 app = FastAPI(title="GAF Contractor Insights API", description="Query contractors and AI-generated insights.")
 
@@ -37,10 +55,77 @@ class ContractorOut(BaseModel):
     next_action: Optional[str]
     latitude: Optional[float]
     longitude: Optional[float]
+    priority_level: Optional[int]
+    lead_score: Optional[float]
 
     class Config:
         orm_mode = True
 
+class ContractorNearbyOut(ContractorOut):
+    distance_miles: float
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+SPATIAL_INDEX = has_spatial_index(engine)
+# First ring of the expanding nearest-neighbour search; each ring without `limit` hits doubles it
+NEARBY_START_RADIUS_MILES = float(os.environ.get("NEARBY_START_RADIUS_MILES", 1.0))
+
+def _lng_ranges(min_lng, max_lng):
+    """Split a longitude span into ranges within [-180, 180]; ``min_lng > max_lng`` crosses the antimeridian."""
+    if min_lng > max_lng:
+        max_lng += 360
+    if max_lng - min_lng >= 360:
+        return [(-180.0, 180.0)]
+    lo = (min_lng + 180) % 360 - 180
+    hi = lo + (max_lng - min_lng)
+    return [(lo, hi)] if hi <= 180 else [(lo, 180.0), (-180.0, hi - 360)]
+
+def _ring_box(lat, lng, miles):
+    """(min_lat, max_lat, lng_ranges) enclosing every point within ``miles`` of lat/lng."""
+    dlat = miles / MILES_PER_DEGREE_LAT
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    # Degrees of longitude per mile are largest on the box edge nearest the pole
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    dlng = miles / (MILES_PER_DEGREE_LAT * cos_lat) if cos_lat > 1e-6 else 180.0
+    return min_lat, max_lat, _lng_ranges(lng - dlng, lng + dlng)
+
+def _box_covers(box, other):
+    min_lat, max_lat, ranges = box
+    return (min_lat <= other[0] and max_lat >= other[1]
+            and all(any(lo <= o_lo and o_hi <= hi for lo, hi in ranges) for o_lo, o_hi in other[2]))
+
+def _box_intersection(box, other):
+    ranges = [(max(lo, o_lo), min(hi, o_hi)) for lo, hi in box[2] for o_lo, o_hi in other[2] if max(lo, o_lo) <= min(hi, o_hi)]
+    return max(box[0], other[0]), min(box[1], other[1]), ranges
+
+def _nearby_candidates(db, box, lat, lng):
+    """(distance, id) of every geocoded contractor inside ``box``, read from the R*Tree when there is one."""
+    min_lat, max_lat, lng_ranges = box
+    candidates = []
+    if min_lat > max_lat:
+        return candidates
+    for min_lng, max_lng in lng_ranges:
+        bounds = {"min_lat": min_lat, "max_lat": max_lat, "min_lng": min_lng, "max_lng": max_lng}
+        if SPATIAL_INDEX:
+            rows = db.execute(text(
+                f"SELECT c.id, c.latitude, c.longitude FROM {SPATIAL_INDEX_TABLE} r JOIN contractors c ON c.id = r.id "
+                "WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat AND r.max_lng >= :min_lng AND r.min_lng <= :max_lng"
+            ), bounds).all()
+        else:
+            rows = db.query(Contractor.id, Contractor.latitude, Contractor.longitude).filter(
+                Contractor.latitude.between(min_lat, max_lat), Contractor.longitude.between(min_lng, max_lng)
+            ).all()
+        for contractor_id, c_lat, c_lng in rows:
+            if min_lat <= c_lat <= max_lat and min_lng <= c_lng <= max_lng:  # R*Tree boxes are rounded outwards to 32-bit floats
+                candidates.append((haversine_miles(lat, lng, c_lat, c_lng), contractor_id))
+    return candidates
+
 def get_db():
     db = Session()
     try:
@@ -48,8 +133,239 @@ def get_db():
     finally:
         db.close()
 
+# With API_ASYNC_DB=1, /contractors, /contractors/{contractor_id} and /export run on an asyncio engine
+# instead of blocking sessions in the threadpool, so slow exports no longer starve fast lookups
+API_ASYNC_DB = os.environ.get("API_ASYNC_DB") == "1"
+async_engine = async_session = None
+if API_ASYNC_DB:
+    from sqlalchemy.ext.asyncio import AsyncSession
+    async_engine = create_async_db_engine()
+    async_session = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Route template of the request being served, so database timings can be labelled per endpoint
+_current_endpoint = contextvars.ContextVar("current_endpoint", default=None)
+
+def _route_path(scope):
+    for route in app.router.routes:
+        if route.matches(scope)[0] == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    endpoint = _route_path(request.scope)
+    token = _current_endpoint.set(endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.API_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method, status=str(status))
+        _current_endpoint.reset(token)
+
+def _instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        endpoint = _current_endpoint.get()
+        if endpoint is not None:
+            metrics.API_DB_QUERY_SECONDS.observe(time.perf_counter() - context._metrics_start, endpoint=endpoint)
+
+_instrument_engine(engine)
+if async_engine is not None:
+    _instrument_engine(async_engine.sync_engine)
+
+def _sync_scalars(statement):
+    with Session() as db:
+        return db.scalars(statement).all()
+
+async def _fetch_scalars(statement):
+    """ORM rows for ``statement`` from the async engine, or from the sync engine in the threadpool."""
+    if async_session is not None:
+        async with async_session() as db:
+            return (await db.scalars(statement)).all()
+    return await run_in_threadpool(_sync_scalars, statement)
+
+# Serialized /contractors and /contractors/{contractor_id} responses, valid until the data version changes
+API_CACHE_TTL = float(os.environ.get("API_CACHE_TTL", 300))
+API_CACHE_MAX_ENTRIES = int(os.environ.get("API_CACHE_MAX_ENTRIES", 2048))
+# How long a read of the data version is trusted before asking the database again
+DATA_VERSION_POLL_SECONDS = float(os.environ.get("DATA_VERSION_POLL_SECONDS", 1.0))
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "headers", "stored_at"])
+
+class VersionedResponseCache:
+    """LRU/TTL cache of JSON bodies that is dropped whenever the data version moves."""
+
+    def __init__(self, max_entries=API_CACHE_MAX_ENTRIES, ttl=API_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _stale(self):
+        return self.version is None or time.monotonic() - self.checked_at >= DATA_VERSION_POLL_SECONDS
+
+    def _set_version(self, version):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+            self.version, self.checked_at = version, time.monotonic()
+
+    def data_version(self):
+        """Blocking read; for sync endpoints, which already run in the threadpool."""
+        if self._stale():
+            with engine.connect() as conn:
+                self._set_version(get_data_version(conn))
+        return self.version
+
+    async def data_version_async(self):
+        """Same as data_version() without blocking the event loop: the async engine, or the sync one in the threadpool."""
+        if self._stale():
+            if async_engine is not None:
+                async with async_engine.connect() as conn:
+                    version = await conn.run_sync(get_data_version)
+                self._set_version(version)
+            else:
+                await run_in_threadpool(self.data_version)
+        return self.version
+
+    def lookup(self, key):
+        """Return ``(data_version, entry)``; entry is None on a miss. Pass the version on to put()."""
+        return self._lookup(key, self.data_version())
+
+    async def lookup_async(self, key):
+        return self._lookup(key, await self.data_version_async())
+
+    def _lookup(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry.stored_at > self.ttl:
+                return version, None
+            self.entries.move_to_end(key)
+            return version, entry
+
+    def put(self, key, version, payload, headers=None):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        entry = CachedResponse(body, f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"', headers or {}, time.monotonic())
+        with self.lock:
+            # Not stored if the data changed while the response was being built
+            if version == self.version:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return entry
+
+response_cache = VersionedResponseCache()
+
+CONTRACTOR_OUT_FIELDS = list(ContractorOut.__annotations__)
+
+def _contractor_json(contractor):
+    return {field: getattr(contractor, field) for field in CONTRACTOR_OUT_FIELDS}
+
+def _cached_response(request, entry):
+    """200 with the cached body, or 304 when the client already holds this ETag."""
+    headers = dict(entry.headers, ETag=entry.etag)
+    headers["Cache-Control"] = "no-cache"  # clients may keep the body but must revalidate
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or entry.etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+def _filter_contractors(query, city=None, state=None, min_rating=None, max_rating=None, certification=None,
+                        certifications=None, certification_match="any", min_score=None):
+    if city:
+        query = query.filter(Contractor.city == city)
+    if state:
+        query = query.filter(Contractor.state == state)
+    if min_rating is not None:
+        query = query.filter(Contractor.rating >= min_rating)
+    if max_rating is not None:
+        query = query.filter(Contractor.rating <= max_rating)
+    if certification:
+        query = query.filter(Contractor.certifications.like(f"%{certification}%"))
+    if min_score is not None:
+        query = query.filter(Contractor.lead_score >= min_score)
+    if certifications:
+        # Exact names, resolved through the indexed contractor_certifications link table
+        names = sorted(set(certifications))
+        links = (
+            select(contractor_certifications.c.contractor_id)
+            .join(Certification, Certification.id == contractor_certifications.c.certification_id)
+            .where(Certification.name.in_(names))
+        )
+        if certification_match == "all":
+            links = links.group_by(contractor_certifications.c.contractor_id).having(func.count() == len(names))
+        query = query.filter(Contractor.id.in_(links))
+    return query
+
+def _encode_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload, default=str).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict) or not isinstance(payload.get("id"), int) or isinstance(payload["id"], bool):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return payload
+
+def _cursor_value(field, value):
+    """The cursor's sort value as the column's Python type; malformed values are a client error, not a 500."""
+    if field is None or value is None:
+        return value
+    python_type = field.type.python_type
+    try:
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type in (int, float) and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        if python_type is str and isinstance(value, str):
+            return value
+    except (TypeError, ValueError):
+        pass
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _sort_field(order_by):
+    return getattr(Contractor, order_by) if order_by and order_by in Contractor.__table__.columns else None
+
+def _order_keyset(query, field, order_desc, after=None, dialect="sqlite"):
+    """Order by ``field`` then ``id`` and, given the last row of the previous page, seek past it.
+
+    NULLs sort first ascending and last descending (SQLite's native order; other dialects get an
+    explicit NULLS FIRST/LAST), so the seek predicate treats them separately.
+    """
+    if field is None:
+        if after is not None:
+            query = query.filter(Contractor.id > after["id"])
+        return query.order_by(Contractor.id.asc())
+    if after is not None:
+        value, last_id = after["value"], after["id"]
+        if order_desc and value is None:
+            query = query.filter(field.is_(None), Contractor.id > last_id)
+        elif order_desc:
+            query = query.filter(or_(field < value, and_(field == value, Contractor.id > last_id), field.is_(None)))
+        elif value is None:
+            query = query.filter(or_(field.isnot(None), and_(field.is_(None), Contractor.id > last_id)))
+        else:
+            query = query.filter(or_(field > value, and_(field == value, Contractor.id > last_id)))
+    order = field.desc() if order_desc else field.asc()
+    if dialect != "sqlite":
+        order = order.nullslast() if order_desc else order.nullsfirst()
+    return query.order_by(order, Contractor.id.asc())
+
 @app.get("/contractors", response_model=List[ContractorOut])
-def list_contractors(
+async def list_contractors(
+    request: Request,
     skip: int = Query(0, ge=0, description="Number of records to skip for pagination"),
     limit: int = Query(10, ge=1, le=100, description="Max number of records to return"),
     city: Optional[str] = Query(None, description="Filter by city"),
@@ -57,42 +373,278 @@ def list_contractors(
     min_rating: Optional[float] = Query(None, description="Minimum rating"),
     max_rating: Optional[float] = Query(None, description="Maximum rating"),
     certification: Optional[str] = Query(None, description="Filter by certification substring"),
-    order_by: Optional[str] = Query(None, description="Order by field: rating, reviews, updated_at"),
+    certifications: Optional[List[str]] = Query(None, description="Filter by exact certification name (repeatable)"),
+    certification_match: Literal["any", "all"] = Query("any", description="Match any or all of the given certifications"),
+    min_score: Optional[float] = Query(None, ge=0, le=100, description="Minimum lead score (0-100)"),
+    order_by: Optional[str] = Query(None, description="Order by field: lead_score, rating, reviews, updated_at"),
     order_desc: bool = Query(True, description="Descending order if true"),
-    db: OrmSession = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
 ):
-    """List contractors with advanced filters and ordering."""
+    """List contractors with advanced filters and ordering.
+
+    Full pages carry an ``X-Next-Cursor`` header; pass it back as ``cursor`` (with the same filters
+    and ordering) to fetch the next page by keyset instead of offset. Responses carry an ETag and
+    are served from memory until the data changes.
+    """
+    field = _sort_field(order_by)
+    after = None
+    if cursor:
+        if skip:
+            raise HTTPException(status_code=400, detail="Use either cursor or skip, not both")
+        after = _decode_cursor(cursor)
+        if after.get("order_by") != (order_by if field is not None else None) or after.get("desc") != order_desc:
+            raise HTTPException(status_code=400, detail="Cursor does not match the requested ordering")
+        after["value"] = _cursor_value(field, after.get("value"))
+    cache_key = ("list", skip, limit, city, state, min_rating, max_rating, certification,
+                 tuple(sorted(set(certifications))) if certifications else None, certification_match, min_score,
+                 order_by if field is not None else None, order_desc, cursor)
+    version, entry = await response_cache.lookup_async(cache_key)
+    if entry is not None:
+        return _cached_response(request, entry)
     try:
-        query = db.query(Contractor)
-        if city:
-            query = query.filter(Contractor.city == city)
-        if state:
-            query = query.filter(Contractor.state == state)
-        if min_rating is not None:
-            query = query.filter(Contractor.rating >= min_rating)
-        if max_rating is not None:
-            query = query.filter(Contractor.rating <= max_rating)
-        if certification:
-            query = query.filter(Contractor.certifications.like(f"%{certification}%"))
-        if order_by:
-            field = getattr(Contractor, order_by, None)
-            if field is not None:
-                query = query.order_by(field.desc() if order_desc else field.asc())
-        result = query.offset(skip).limit(limit).all()
-        return result
+        query = _filter_contractors(select(Contractor), city, state, min_rating, max_rating, certification,
+                                    certifications, certification_match, min_score)
+        query = _order_keyset(query, field, order_desc, after, engine.dialect.name)
+        result = await _fetch_scalars(query.offset(skip).limit(limit))
+        headers = {}
+        if len(result) == limit:
+            last = result[-1]
+            headers["X-Next-Cursor"] = _encode_cursor({
+                "order_by": order_by if field is not None else None,
+                "desc": order_desc,
+                "value": getattr(last, order_by) if field is not None else None,
+                "id": last.id,
+            })
+        entry = response_cache.put(cache_key, version, [_contractor_json(c) for c in result], headers)
+        return _cached_response(request, entry)
     except Exception as e:
         import traceback
         print("Error in /contractors endpoint:", e)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/contractors/nearby", response_model=List[ContractorNearbyOut])
+def nearby_contractors(
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="Latitude of the search center"),
+    lng: Optional[float] = Query(None, ge=-180, le=180, description="Longitude of the search center"),
+    radius_miles: Optional[float] = Query(None, gt=0, le=500, description="Search radius around lat/lng"),
+    min_lat: Optional[float] = Query(None, ge=-90, le=90, description="Bounding box south edge"),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90, description="Bounding box north edge"),
+    min_lng: Optional[float] = Query(None, ge=-180, le=180, description="Bounding box west edge"),
+    max_lng: Optional[float] = Query(None, ge=-180, le=180, description="Bounding box east edge"),
+    limit: int = Query(50, ge=1, le=500, description="Max number of records to return"),
+    db: OrmSession = Depends(get_db)
+):
+    """Contractors within a radius of lat/lng, or inside a bounding box, nearest first.
+
+    The search scans rings of doubling radius around the center and stops at the first ring holding
+    ``limit`` hits, so the rows read grow with ``limit`` rather than with the size of the search area.
+    A bounding box with ``min_lng > max_lng`` crosses the antimeridian.
+    """
+    if radius_miles is not None:
+        if lat is None or lng is None:
+            raise HTTPException(status_code=400, detail="radius_miles requires lat and lng")
+        area, max_distance = None, radius_miles
+    elif None in (min_lat, max_lat, min_lng, max_lng):
+        raise HTTPException(status_code=400, detail="Provide lat, lng and radius_miles, or min_lat, max_lat, min_lng and max_lng")
+    else:
+        area, max_distance = (min_lat, max_lat, _lng_ranges(min_lng, max_lng)), math.inf
+        if lat is None or lng is None:
+            width = max_lng - min_lng if min_lng <= max_lng else max_lng - min_lng + 360
+            lat, lng = (min_lat + max_lat) / 2, (min_lng + width / 2 + 180) % 360 - 180
+    miles = min(NEARBY_START_RADIUS_MILES, max_distance)
+    while True:
+        ring = _ring_box(lat, lng, miles)
+        last = miles >= max_distance or (area is not None and _box_covers(ring, area))
+        box = ring if area is None else _box_intersection(ring, area)
+        # Until the last ring only hits within its radius are certain to be nearer than anything outside it
+        cutoff = max_distance if last else miles
+        candidates = _nearby_candidates(db, box, lat, lng)
+        distances = [hit for hit in candidates if hit[0] <= cutoff]
+        if last or len(distances) >= limit:
+            break
+        if len(candidates) >= limit:
+            # The box corners already hold `limit` contractors, so none of the nearest lie beyond the farthest of them
+            miles = min(heapq.nsmallest(limit, candidates)[-1][0], max_distance)
+        else:
+            miles = min(miles * 2, max_distance)
+    distances.sort()
+    distances = distances[:limit]
+    contractors = {c.id: c for c in db.query(Contractor).filter(Contractor.id.in_([i for _, i in distances]))}
+    result = []
+    for distance, contractor_id in distances:
+        contractor = contractors[contractor_id]
+        contractor.distance_miles = round(distance, 3)
+        result.append(contractor)
+    return result
+
 @app.get("/contractors/{contractor_id}", response_model=ContractorOut)
-def get_contractor(contractor_id: str, db: OrmSession = Depends(get_db)):
+async def get_contractor(contractor_id: str, request: Request):
     """Get contractor details by contractor_id."""
-    contractor = db.query(Contractor).filter(Contractor.contractor_id == contractor_id).first()
-    if not contractor:
-        raise HTTPException(status_code=404, detail="Contractor not found")
-    return contractor
+    cache_key = ("detail", contractor_id)
+    version, entry = await response_cache.lookup_async(cache_key)
+    if entry is None:
+        result = await _fetch_scalars(select(Contractor).where(Contractor.contractor_id == contractor_id).limit(1))
+        if not result:
+            raise HTTPException(status_code=404, detail="Contractor not found")
+        entry = response_cache.put(cache_key, version, _contractor_json(result[0]))
+    return _cached_response(request, entry)
+
+# Map clustering: a 256px web-mercator tile is split into MAP_CELLS_PER_TILE^2 grid cells, so the number of
+# clusters in a viewport is bounded by its size on screen, not by how many contractors it contains
+MAP_CELLS_PER_TILE = 4
+MAP_POINT_ZOOM = 13  # At this zoom and above, individual contractors are returned instead of clusters
+MAP_MAX_CELLS = 1024  # Requests spanning more cells than this are clustered at a coarser zoom
+MAP_MAX_POINTS = 2000
+def _cell_size(zoom):
+    return 360.0 / (2 ** zoom * MAP_CELLS_PER_TILE)
+
+def _priority_level():
+    # Name of the stored priority_level; rows not scored yet count as unknown
+    return case({value: name for name, value in PRIORITY_LEVELS.items()}, value=Contractor.priority_level, else_="unknown")
+
+@app.get("/map/clusters")
+def map_clusters(
+    request: Request,
+    min_lat: float = Query(..., ge=-90, le=90, description="Viewport south edge"),
+    max_lat: float = Query(..., ge=-90, le=90, description="Viewport north edge"),
+    min_lng: float = Query(..., ge=-180, le=180, description="Viewport west edge"),
+    max_lng: float = Query(..., ge=-180, le=180, description="Viewport east edge"),
+    zoom: int = Query(..., ge=0, le=22, description="Map zoom level (web-mercator)"),
+    city: Optional[str] = Query(None),
+    state: Optional[str] = Query(None),
+    min_rating: Optional[float] = Query(None),
+    max_rating: Optional[float] = Query(None),
+    certification: Optional[str] = Query(None),
+    certifications: Optional[List[str]] = Query(None, description="Filter by exact certification name (repeatable)"),
+    certification_match: Literal["any", "all"] = Query("any", description="Match any or all of the given certifications"),
+    min_score: Optional[float] = Query(None, ge=0, le=100, description="Minimum lead score (0-100)"),
+    db: OrmSession = Depends(get_db)
+):
+    """Zoom-aware grid clusters (count, centroid, priority mix, mean rating) for a viewport.
+
+    Below MAP_POINT_ZOOM contractors are aggregated into grid cells in SQL; at or above it the
+    individual contractors in the viewport are returned (at most MAP_MAX_POINTS).
+    """
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="Viewport minimums must not exceed maximums")
+    effective_zoom = zoom
+    while effective_zoom > 0 and ((max_lat - min_lat) / _cell_size(effective_zoom) + 1) * ((max_lng - min_lng) / _cell_size(effective_zoom) + 1) > MAP_MAX_CELLS:
+        effective_zoom -= 1
+    cell = _cell_size(effective_zoom)
+    # Snap the viewport outwards to the grid so small pans reuse the cached response
+    min_lat, max_lat = max(-90.0, math.floor((min_lat + 90) / cell) * cell - 90), min(90.0, math.ceil((max_lat + 90) / cell) * cell - 90)
+    min_lng, max_lng = max(-180.0, math.floor((min_lng + 180) / cell) * cell - 180), min(180.0, math.ceil((max_lng + 180) / cell) * cell - 180)
+    filters = {"city": city, "state": state, "min_rating": min_rating, "max_rating": max_rating, "certification": certification,
+               "certifications": certifications, "certification_match": certification_match, "min_score": min_score}
+    points_mode = effective_zoom >= MAP_POINT_ZOOM
+    cache_key = ("clusters", effective_zoom, points_mode, min_lat, max_lat, min_lng, max_lng, city, state, min_rating, max_rating,
+                 certification, tuple(sorted(set(certifications))) if certifications else None, certification_match, min_score)
+    version, entry = response_cache.lookup(cache_key)
+    if entry is not None:
+        return _cached_response(request, entry)
+    in_view = [Contractor.latitude.between(min_lat, max_lat), Contractor.longitude.between(min_lng, max_lng)]
+    level = _priority_level()
+    result = {"zoom": effective_zoom, "cell_size_deg": cell, "mode": "points" if points_mode else "clusters",
+              "bounds": [min_lat, min_lng, max_lat, max_lng]}
+    if points_mode:
+        query = _filter_contractors(select(
+            Contractor.contractor_id, Contractor.name, Contractor.latitude, Contractor.longitude, Contractor.rating,
+            Contractor.city, Contractor.state, Contractor.priority_suggestion, level.label("priority"),
+        ).where(*in_view), **filters).order_by(Contractor.id).limit(MAP_MAX_POINTS + 1)
+        rows = [row._asdict() for row in db.execute(query)]
+        result["truncated"] = len(rows) > MAP_MAX_POINTS
+        result["points"] = rows[:MAP_MAX_POINTS]
+        # Matching contractors in view, not just the ones returned
+        result["total"] = db.execute(_filter_contractors(
+            select(func.count(Contractor.id)).where(*in_view), **filters
+        )).scalar() if result["truncated"] else len(rows)
+    else:
+        gx = cast((Contractor.longitude + 180.0) / cell, Integer).label("gx")
+        gy = cast((Contractor.latitude + 90.0) / cell, Integer).label("gy")
+        query = _filter_contractors(select(
+            gx, gy, func.count().label("count"),
+            func.avg(Contractor.latitude).label("lat"), func.avg(Contractor.longitude).label("lng"),
+            func.avg(Contractor.rating).label("avg_rating"),
+            *[func.sum(case((level == name, 1), else_=0)).label(name) for name in PRIORITY_LEVELS],
+        ).where(*in_view), **filters).group_by(gx, gy)
+        clusters = []
+        for row in db.execute(query):
+            clusters.append({
+                "lat": round(row.lat, 6), "lng": round(row.lng, 6), "count": row.count,
+                "avg_rating": round(row.avg_rating, 2) if row.avg_rating is not None else None,
+                "priority": {name: getattr(row, name) for name in PRIORITY_LEVELS},
+                "cell": [row.gy * cell - 90, row.gx * cell - 180, (row.gy + 1) * cell - 90, (row.gx + 1) * cell - 180],
+            })
+        result["clusters"] = clusters
+        result["total"] = sum(c["count"] for c in clusters)
+    entry = response_cache.put(cache_key, version, result)
+    return _cached_response(request, entry)
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+class CsvChunker:
+    """CSV writer that hands back UTF-8 (optionally gzipped) bytes roughly every EXPORT_FLUSH_BYTES."""
+
+    def __init__(self, columns, compress):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None  # gzip container
+        self.writer.writerow(columns)
+
+    def _drain(self):
+        data = self.buffer.getvalue().encode("utf-8")
+        self.buffer.seek(0)
+        self.buffer.truncate(0)
+        return self.compressor.compress(data) if self.compressor else data
+
+    def write(self, row):
+        self.writer.writerow(row)
+        return self._drain() if self.buffer.tell() >= EXPORT_FLUSH_BYTES else b""
+
+    def close(self):
+        chunk = self._drain()
+        if self.compressor:
+            chunk += self.compressor.flush()
+        return chunk
+
+def _export_query(columns, filters):
+    query = _filter_contractors(select(*[getattr(Contractor, col) for col in columns]), **filters)
+    return query.order_by(Contractor.id).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+
+def _stream_csv(columns, filters, compress):
+    """Yield the export as CSV chunks while rows are read from a server-side cursor.
+
+    The generator owns its session because the response body is produced after the endpoint returns.
+    """
+    db = Session()
+    try:
+        chunker = CsvChunker(columns, compress)
+        for row in db.execute(_export_query(columns, filters)):
+            chunk = chunker.write(row)
+            if chunk:
+                yield chunk
+        chunk = chunker.close()
+        if chunk:
+            yield chunk
+    finally:
+        db.close()
+
+async def _stream_csv_async(columns, filters, compress):
+    """Async twin of _stream_csv for API_ASYNC_DB: rows are awaited instead of read on a threadpool worker."""
+    async with async_session() as db:
+        chunker = CsvChunker(columns, compress)
+        result = await db.stream(_export_query(columns, filters))
+        # One await per partition, not per row: each fetch is a round trip to the driver thread
+        async for rows in result.partitions():
+            for row in rows:
+                chunk = chunker.write(row)
+                if chunk:
+                    yield chunk
+        chunk = chunker.close()
+        if chunk:
+            yield chunk
 
 @app.get("/export")
 def export_contractors(
@@ -101,29 +653,44 @@ def export_contractors(
     min_rating: Optional[float] = Query(None),
     max_rating: Optional[float] = Query(None),
     certification: Optional[str] = Query(None),
-    db: OrmSession = Depends(get_db)
+    certifications: Optional[List[str]] = Query(None, description="Filter by exact certification name (repeatable)"),
+    certification_match: Literal["any", "all"] = Query("any", description="Match any or all of the given certifications"),
+    min_score: Optional[float] = Query(None, ge=0, le=100, description="Minimum lead score (0-100)"),
+    columns: Optional[str] = Query(None, description="Comma-separated columns to export (default: all)"),
+    use_gzip: bool = Query(False, alias="gzip", description="Gzip the response body (Content-Encoding: gzip)"),
 ):
-    """Export filtered contractors as CSV."""
-    query = db.query(Contractor)
-    if city:
-        query = query.filter(Contractor.city == city)
-    if state:
-        query = query.filter(Contractor.state == state)
-    if min_rating is not None:
-        query = query.filter(Contractor.rating >= min_rating)
-    if max_rating is not None:
-        query = query.filter(Contractor.rating <= max_rating)
-    if certification:
-        query = query.filter(Contractor.certifications.like(f"%{certification}%"))
-    contractors = query.all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    header = [c.name for c in Contractor.__table__.columns]
-    writer.writerow(header)
-    for c in contractors:
-        writer.writerow([getattr(c, col) for col in header])
-    output.seek(0)
-    return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=contractors_export.csv"})
+    """Export filtered contractors as CSV, streamed row by row."""
+    all_columns = [c.name for c in Contractor.__table__.columns]
+    selected = [c.strip() for c in columns.split(",") if c.strip()] if columns else all_columns
+    unknown = [c for c in selected if c not in all_columns]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}" if unknown else "No columns selected")
+    filters = {"city": city, "state": state, "min_rating": min_rating, "max_rating": max_rating, "certification": certification,
+               "certifications": certifications, "certification_match": certification_match, "min_score": min_score}
+    headers = {"Content-Disposition": "attachment; filename=contractors_export.csv"}
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+    stream = _stream_csv_async if async_session is not None else _stream_csv
+    return StreamingResponse(stream(selected, filters, use_gzip), media_type="text/csv", headers=headers)
+
+@app.get("/stats")
+def contractor_stats(request: Request, top: int = Query(STATS_TOP_N, ge=1, le=500, description="Number of states, cities and types to list")):
+    """Aggregates computed in SQL: counts by state/city/type, rating, review and score histograms, coverage."""
+    cache_key = ("stats", top)
+    version, entry = response_cache.lookup(cache_key)
+    if entry is None:
+        entry = response_cache.put(cache_key, version, compute_stats(top_n=top))
+    return _cached_response(request, entry)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Request, database, pipeline and LLM metrics of this process in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/version")
+def data_version():
+    """Current data version; it changes whenever the ETL, a job or a manual edit commits new data."""
+    return {"data_version": response_cache.data_version()}
 
 # Root endpoint
 @app.get("/")
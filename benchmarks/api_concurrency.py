@@ -0,0 +1,140 @@
+"""Latency of the API under N concurrent clients, sync engine vs API_ASYNC_DB=1.
+
+Starts uvicorn once per mode against the current database, then for every concurrency level
+runs that many clients, each issuing a mix of list, detail and export requests back to back.
+Prints p50/p99 latency (ms) per mode, level and endpoint as JSON.
+
+    python benchmarks/api_concurrency.py --concurrency 50,100,200,500 --output api_concurrency.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import select
+from models import Contractor, Session
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def summarize(latencies):
+    return {"requests": len(latencies), "p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99)}
+
+def sample_targets(count=200):
+    with Session() as db:
+        rows = db.execute(select(Contractor.contractor_id, Contractor.state).limit(count)).all()
+    if not rows:
+        raise SystemExit("No contractors in the database; collect or generate data first")
+    return [r.contractor_id for r in rows], sorted({r.state for r in rows if r.state})
+
+def build_requests(ids, states, export_share):
+    """Endpoint mix: mostly list and detail lookups with a share of full exports."""
+    def pick():
+        roll = random.random()
+        if roll < export_share:
+            return "export", "/export?columns=contractor_id,name,city,state,rating,reviews"
+        if roll < export_share + (1 - export_share) / 2:
+            params = f"&state={random.choice(states)}" if states else ""
+            return "list", f"/contractors?limit=20&order_by=rating{params}"
+        return "detail", f"/contractors/{random.choice(ids)}"
+    return pick
+
+async def run_level(base_url, concurrency, requests_per_client, pick):
+    latencies = {"all": [], "list": [], "detail": [], "export": []}
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+
+        async def worker():
+            nonlocal errors
+            for _ in range(requests_per_client):
+                kind, path = pick()
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    await response.aread()
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                elapsed = (time.perf_counter() - start) * 1000
+                if not ok:
+                    errors += 1
+                    continue
+                latencies["all"].append(elapsed)
+                latencies[kind].append(elapsed)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+    result = {kind: summarize(values) for kind, values in latencies.items()}
+    result["errors"] = errors
+    result["throughput_rps"] = round(len(latencies["all"]) / seconds, 1)
+    return result
+
+def start_server(port, async_db):
+    env = dict(os.environ, API_ASYNC_DB="1" if async_db else "0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    for _ in range(100):
+        if server.poll() is not None:
+            raise SystemExit(f"API server exited with code {server.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("API server did not start")
+
+def run_benchmark(levels, requests_per_client=10, export_share=0.05, modes=("sync", "async"), port=8799):
+    """Run every concurrency level against a fresh server per mode; returns the report dict."""
+    random.seed(0)
+    ids, states = sample_targets()
+    pick = build_requests(ids, states, export_share)
+    report = {"requests_per_client": requests_per_client, "export_share": export_share, "results": {}}
+    for mode in modes:
+        server = start_server(port, mode == "async")
+        try:
+            for level in levels:
+                result = asyncio.run(run_level(f"http://127.0.0.1:{port}", level, requests_per_client, pick))
+                report["results"].setdefault(mode, {})[level] = result
+                print(f"{mode:5} c={level:<4} p50={result['all']['p50_ms'] or 0:.1f}ms p99={result['all']['p99_ms'] or 0:.1f}ms "
+                      f"rps={result['throughput_rps']} errors={result['errors']}", file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="50,100,200,500", help="Comma-separated client counts")
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--export-share", type=float, default=0.05, help="Fraction of requests that are full exports")
+    parser.add_argument("--modes", default="sync,async", help="sync, async or both")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark([int(n) for n in args.concurrency.split(",")], args.requests_per_client, args.export_share,
+                           args.modes.split(","), args.port)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
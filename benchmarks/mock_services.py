@@ -0,0 +1,172 @@
+"""Local stand-ins for Coveo search, OpenAI chat completions and Nominatim geocoding.
+
+One server answers all three under path prefixes, with per-service latency (mean and jitter, ms)
+and a rate of 429 responses, so the scraper, the LLM jobs and geocoding can be benchmarked offline
+and under throttling. Coveo serves the synthetic dataset from synthetic.py; responses are
+deterministic for a given request.
+
+    python benchmarks/mock_services.py --port 8801 --openai-latency-ms 400 --openai-429-rate 0.05
+
+Point the pipeline at it with the variables from ``service_env(port)``: COVEO_API_URL,
+OPENAI_BASE_URL, NOMINATIM_DOMAIN and NOMINATIM_SCHEME.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import subprocess
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import CITIES, coveo_result
+
+SERVICES = ("coveo", "openai", "geocode")
+DEFAULTS = {
+    "coveo_rows": 5000,
+    "seed": 0,
+    "coveo_latency_ms": 150.0, "coveo_jitter_ms": 50.0, "coveo_429_rate": 0.0,
+    "openai_latency_ms": 500.0, "openai_jitter_ms": 200.0, "openai_429_rate": 0.0,
+    "geocode_latency_ms": 100.0, "geocode_jitter_ms": 30.0, "geocode_429_rate": 0.0, "geocode_miss_rate": 0.05,
+    "retry_after": 0.1,  # seconds, sent with every 429
+}
+
+def _digest(text):
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16)
+
+def create_app(**options):
+    options = dict(DEFAULTS, **options)
+    app = FastAPI(title="Mock Coveo / OpenAI / Nominatim")
+    counters = {service: {"requests": 0, "throttled": 0} for service in SERVICES}
+    rng = random.Random(options["seed"])
+
+    async def delay_or_throttle(service):
+        """Sleep for the service latency; returns a 429 response instead for the configured share of requests."""
+        counters[service]["requests"] += 1
+        latency = rng.gauss(options[f"{service}_latency_ms"], options[f"{service}_jitter_ms"])
+        await asyncio.sleep(max(0.0, latency) / 1000)
+        if rng.random() < options[f"{service}_429_rate"]:
+            counters[service]["throttled"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_exceeded"}},
+                status_code=429, headers={"retry-after": str(options["retry_after"])},
+            )
+        return None
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok", "options": options, "counters": counters}
+
+    @app.post("/coveo/search")
+    async def coveo_search(request: Request):
+        throttled = await delay_or_throttle("coveo")
+        if throttled:
+            return throttled
+        body = await request.json()
+        first = int(body.get("firstResult", 0))
+        count = int(body.get("numberOfResults", 10))
+        total = options["coveo_rows"]
+        results = [coveo_result(i, options["seed"]) for i in range(first, min(first + count, total))]
+        return {"totalCount": total, "results": results}
+
+    def completion_text(body):
+        prompt = body["messages"][-1]["content"]
+        h = _digest(prompt)
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            priority = ("High", "Medium", "Low")[h % 3]
+            return json.dumps({
+                "business_summary": "Established residential roofer with steady review volume and an active local presence.",
+                "sales_tip": "Lead with certification upgrades; open with their recent review growth.",
+                "risk_alert": "No negative trend in recent reviews." if h % 5 else "Rating dipped over the last quarter.",
+                "priority_suggestion": f"{priority} priority: rating, review count and certifications considered.",
+                "next_action": "Call mid-morning on a weekday and follow up with a brochure by email.",
+            })
+        if "Score the insight" in prompt:
+            # One in ten insights scores 2 on one dimension, so regenerate_low_score_insights has work
+            low = h % 10 == 0
+            scores = [2 if low and k == h % 4 else 4 + (h >> k) % 2 for k in range(4)]
+            return json.dumps({"relevance": scores[0], "actionability": scores[1], "accuracy": scores[2], "clarity": scores[3],
+                               "comment": "Specific and actionable." if min(scores) > 2 else "Too generic to act on."})
+        words = max(10, int(body.get("max_tokens") or 200) * 3 // 5)
+        return " ".join(("Mock insight: strong local reputation, upsell premium shingles and warranty options.".split() * words)[:words])
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        throttled = await delay_or_throttle("openai")
+        if throttled:
+            return throttled
+        body = await request.json()
+        content = completion_text(body)
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return {
+            "id": f"chatcmpl-mock-{counters['openai']['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.get("/nominatim/search")
+    async def nominatim_search(q: str = ""):
+        throttled = await delay_or_throttle("geocode")
+        if throttled:
+            return throttled
+        h = _digest(q)
+        if (h % 1000) / 1000 < options["geocode_miss_rate"]:
+            return []
+        city = next((c for c in CITIES if q.upper().startswith(c[0].upper())), None)
+        lat, lng = (city[2], city[3]) if city else (25 + (h % 2400) / 100, -124 + (h // 2400 % 5700) / 100)
+        lat, lng = lat + ((h >> 16) % 1000 - 500) / 2500, lng + ((h >> 32) % 1000 - 500) / 2500
+        return [{"place_id": h % 10 ** 9, "lat": str(lat), "lon": str(lng), "display_name": q,
+                 "boundingbox": [str(lat - 0.01), str(lat + 0.01), str(lng - 0.01), str(lng + 0.01)]}]
+
+    return app
+
+def service_env(port, host="127.0.0.1"):
+    """Environment variables that point gaf_scraper, llm/etl and geocoding at the mock server."""
+    base = f"{host}:{port}"
+    return {
+        "COVEO_API_URL": f"http://{base}/coveo/search",
+        "OPENAI_BASE_URL": f"http://{base}/openai/v1",
+        "OPENAI_API_KEY": "mock-key",
+        "NOMINATIM_DOMAIN": f"{base}/nominatim",
+        "NOMINATIM_SCHEME": "http",
+    }
+
+def start_mock_services(port, **options):
+    """Start the mock server in a subprocess and wait until it answers; the caller terminates it."""
+    args = [sys.executable, os.path.abspath(__file__), "--port", str(port)]
+    for key, value in options.items():
+        args += [f"--{key.replace('_', '-')}", str(value)]
+    server = subprocess.Popen(args)
+    for _ in range(100):
+        if server.poll() is not None:
+            raise SystemExit(f"Mock services exited with code {server.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("Mock services did not start")
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8801)
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+    uvicorn.run(create_app(**args), host="127.0.0.1", port=port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
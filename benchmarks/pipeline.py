@@ -0,0 +1,171 @@
+"""Offline benchmarks for the scraper, ETL, LLM jobs and API against synthetic data and mock services.
+
+Everything runs in a scratch directory with its own SQLite database and with the Coveo, OpenAI and
+Nominatim stand-ins from mock_services.py, so no network access or API keys are needed and runs
+with the same arguments are comparable. Results (timings, throughput, per-stage metrics) are
+printed as JSON; progress output goes to stderr.
+
+    python benchmarks/pipeline.py --output bench.json
+    python benchmarks/pipeline.py --benchmarks insights,evaluation --llm-rows 500 --openai-429-rate 0.1
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from mock_services import DEFAULTS as MOCK_DEFAULTS, service_env, start_mock_services
+from synthetic import generate_contractors, load_database
+
+BENCHMARKS = ["clean_and_insert", "collect_data", "geocode", "insights", "multi_insights", "evaluation", "regenerate", "api"]
+# Per-call result keys that only list ids or batches and would swamp the report
+BULKY_KEYS = {"inserted_ids", "updated_ids", "batches"}
+
+def _compact(value):
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items() if k not in BULKY_KEYS}
+    return value
+
+def measure(func, *args, **kwargs):
+    """Run ``func`` once; returns its (compacted) result with wall time and the metrics it recorded."""
+    import metrics
+    since = metrics.summary()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return {"seconds": round(time.perf_counter() - start, 3), "result": _compact(result), "metrics": metrics.summary(since)}
+
+def reset_database():
+    from sqlalchemy import text
+    from models import engine, bump_data_version
+    with engine.begin() as conn:
+        for table in ("contractor_certifications", "certifications", "contractors", "geocode_cache"):
+            conn.execute(text(f"DELETE FROM {table}"))
+        bump_data_version(conn)
+
+def contractor_ids(limit):
+    from sqlalchemy import select
+    from models import Contractor, Session
+    with Session() as session:
+        return session.execute(select(Contractor.id).order_by(Contractor.id).limit(limit)).scalars().all()
+
+def bench_clean_and_insert(sizes):
+    """Fresh insert, an unchanged re-run and a run with 10% of rows changed, per dataset size."""
+    from etl import clean_and_insert
+    results = {}
+    for size in sizes:
+        reset_database()
+        rows = list(generate_contractors(size))
+        report = {"insert": measure(clean_and_insert, rows), "unchanged": measure(clean_and_insert, rows)}
+        for row in rows[::10]:
+            row["reviews"] += 1
+        report["update_10pct"] = measure(clean_and_insert, rows)
+        for run in report.values():
+            run["rows_per_second"] = round(size / run["seconds"], 1) if run["seconds"] else None
+        results[size] = report
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help=f"Comma-separated subset of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--rows", default="1000,10000", help="clean_and_insert dataset sizes")
+    parser.add_argument("--coveo-rows", type=int, default=2000, help="Contractors served by the mock Coveo (max 5000 per query)")
+    parser.add_argument("--llm-rows", type=int, default=200, help="Contractors processed by geocoding and each LLM job")
+    parser.add_argument("--api-rows", type=int, default=10000, help="Synthetic contractors loaded before the API benchmark")
+    parser.add_argument("--api-concurrency", default="10,50")
+    parser.add_argument("--api-requests-per-client", type=int, default=5)
+    parser.add_argument("--api-modes", default="sync,async")
+    parser.add_argument("--port", type=int, default=8801, help="Mock services port")
+    parser.add_argument("--api-port", type=int, default=8799)
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    for key, value in MOCK_DEFAULTS.items():
+        if key not in ("coveo_rows", "seed"):
+            parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    selected = [name for name in args.benchmarks.split(",") if name]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    mock_options = {key: getattr(args, key) for key in MOCK_DEFAULTS if key not in ("coveo_rows", "seed")}
+    mock_options["coveo_rows"] = args.coveo_rows
+    output = os.path.abspath(args.output) if args.output else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="gaf-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    # The repo modules read their configuration at import time, so it has to be in place first
+    os.environ.update(service_env(args.port))
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LLM_CACHE_DISABLED": "1",
+        "ZIP_CENTROIDS_PATH": os.path.join(workdir, "no_zip_centroids.csv"),  # every address goes to the geocoder
+        "METRICS_SUMMARY_DIR": os.path.join(workdir, "run_summaries"),
+    })
+    os.chdir(workdir)  # log files land in the scratch directory
+
+    try:
+        git_commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        git_commit = None
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                        "git_commit": git_commit},
+        "config": dict(vars(args), workdir=workdir),
+        "results": {},
+    }
+    server = start_mock_services(args.port, **mock_options)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):  # the jobs print progress; stdout is reserved for the report
+            import etl
+            from gaf_scraper import collect_data
+            etl.GEOCODE_MIN_INTERVAL = 0.0  # the mock has no usage policy to respect
+            results = report["results"]
+            if "clean_and_insert" in selected:
+                results["clean_and_insert"] = bench_clean_and_insert([int(n) for n in args.rows.split(",")])
+            if "collect_data" in selected or any(name in selected for name in ("geocode", "insights", "multi_insights", "evaluation", "regenerate")):
+                reset_database()
+                run = measure(collect_data, page_size=100)
+                if "collect_data" in selected:
+                    results["collect_data"] = run
+            ids = contractor_ids(args.llm_rows)
+            jobs = {
+                "geocode": lambda: etl.geocode_and_update_latlng(ids=ids),
+                "insights": lambda: etl.update_insights(ids=ids),
+                "multi_insights": lambda: etl.update_multi_insights(ids=ids),
+                "evaluation": lambda: etl.evaluate_insights(ids=ids),
+                "regenerate": lambda: etl.regenerate_low_score_insights(ids=ids),
+            }
+            for name, job in jobs.items():
+                if name in selected:
+                    results[name] = measure(job)
+                    results[name]["contractors"] = len(ids)
+            if "api" in selected:
+                from api_concurrency import run_benchmark
+                reset_database()
+                results["api"] = {"load": load_database(args.api_rows)}
+                results["api"].update(run_benchmark([int(n) for n in args.api_concurrency.split(",")],
+                                                    args.api_requests_per_client, modes=args.api_modes.split(","),
+                                                    port=args.api_port))
+    finally:
+        server.terminate()
+        server.wait()
+        os.chdir(ROOT)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Synthetic GAF contractors with realistic city/state, rating, review and certification distributions.
+
+Row ``i`` depends only on ``i`` and the seed, so the mock Coveo server can serve any page of a
+dataset without materializing it, and repeated runs load identical data.
+
+    python benchmarks/synthetic.py --rows 100000                  # upsert into DATABASE_URL
+    python benchmarks/synthetic.py --rows 1000 --output rows.ndjson
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# (city, state, latitude, longitude, ZIP prefix, relative weight ~ metro population)
+CITIES = [
+    ("New York", "NY", 40.7128, -74.0060, "100", 19.8), ("Los Angeles", "CA", 34.0522, -118.2437, "900", 13.2),
+    ("Chicago", "IL", 41.8781, -87.6298, "606", 9.5), ("Dallas", "TX", 32.7767, -96.7970, "752", 7.6),
+    ("Houston", "TX", 29.7604, -95.3698, "770", 7.1), ("Washington", "DC", 38.9072, -77.0369, "200", 6.3),
+    ("Philadelphia", "PA", 39.9526, -75.1652, "191", 6.2), ("Miami", "FL", 25.7617, -80.1918, "331", 6.1),
+    ("Atlanta", "GA", 33.7490, -84.3880, "303", 6.1), ("Boston", "MA", 42.3601, -71.0589, "021", 4.9),
+    ("Phoenix", "AZ", 33.4484, -112.0740, "850", 4.8), ("San Francisco", "CA", 37.7749, -122.4194, "941", 4.7),
+    ("Riverside", "CA", 33.9806, -117.3755, "925", 4.6), ("Detroit", "MI", 42.3314, -83.0458, "482", 4.4),
+    ("Seattle", "WA", 47.6062, -122.3321, "981", 4.0), ("Minneapolis", "MN", 44.9778, -93.2650, "554", 3.7),
+    ("San Diego", "CA", 32.7157, -117.1611, "921", 3.3), ("Tampa", "FL", 27.9506, -82.4572, "336", 3.2),
+    ("Denver", "CO", 39.7392, -104.9903, "802", 3.0), ("Baltimore", "MD", 39.2904, -76.6122, "212", 2.8),
+    ("St. Louis", "MO", 38.6270, -90.1994, "631", 2.8), ("Orlando", "FL", 28.5383, -81.3792, "328", 2.7),
+    ("Charlotte", "NC", 35.2271, -80.8431, "282", 2.7), ("San Antonio", "TX", 29.4241, -98.4936, "782", 2.6),
+    ("Portland", "OR", 45.5152, -122.6784, "972", 2.5), ("Sacramento", "CA", 38.5816, -121.4944, "958", 2.4),
+    ("Pittsburgh", "PA", 40.4406, -79.9959, "152", 2.4), ("Austin", "TX", 30.2672, -97.7431, "787", 2.4),
+    ("Las Vegas", "NV", 36.1699, -115.1398, "891", 2.3), ("Cincinnati", "OH", 39.1031, -84.5120, "452", 2.3),
+    ("Kansas City", "MO", 39.0997, -94.5786, "641", 2.2), ("Columbus", "OH", 39.9612, -82.9988, "432", 2.1),
+    ("Indianapolis", "IN", 39.7684, -86.1581, "462", 2.1), ("Cleveland", "OH", 41.4993, -81.6944, "441", 2.1),
+    ("Nashville", "TN", 36.1627, -86.7816, "372", 2.0), ("Jacksonville", "FL", 30.3322, -81.6557, "322", 1.6),
+    ("Oklahoma City", "OK", 35.4676, -97.5164, "731", 1.4), ("Raleigh", "NC", 35.7796, -78.6382, "276", 1.4),
+    ("Louisville", "KY", 38.2527, -85.7585, "402", 1.3), ("Omaha", "NE", 41.2565, -95.9345, "681", 1.0),
+]
+# (name, share of contractors holding it); most are plain "Certified", few reach the top tiers
+CERTIFICATIONS = [
+    ("Certified", 0.55), ("Master Elite", 0.12), ("President's Club Award", 0.03), ("Triple Excellence Award", 0.04),
+    ("Consumer Protection Excellence Award", 0.06), ("Installation Master", 0.08), ("Solar Certified", 0.02),
+    ("Certified Plus", 0.10),
+]
+TYPES = [("Residential", 0.55), ("Residential & Commercial", 0.30), ("Commercial", 0.15)]
+NAME_PARTS = (
+    ["Summit", "Apex", "Liberty", "Eagle", "Pioneer", "Heritage", "Premier", "Blue Ridge", "Iron", "Golden", "Pinnacle",
+     "Allied", "Precision", "Evergreen", "Keystone", "Patriot", "Cornerstone", "Skyline", "Lone Star", "Coastal"],
+    ["Roofing", "Roofing & Siding", "Exteriors", "Roof Systems", "Construction", "Home Improvement", "Restoration"],
+    ["LLC", "Inc.", "Co.", "Group", "& Sons", ""],
+)
+
+_city_weights = [city[5] for city in CITIES]
+_city_coordinates = {city[0]: (city[2], city[3]) for city in CITIES}
+_type_names, _type_weights = zip(*TYPES)
+
+def contractor(i, seed=0):
+    """Contractor ``i`` in the shape returned by gaf_scraper.parse_results()."""
+    rng = random.Random(seed * 1_000_003 + i)
+    city, state, _, _, zip_prefix, _ = rng.choices(CITIES, weights=_city_weights)[0]
+    name = " ".join(part for part in (rng.choice(NAME_PARTS[0]), rng.choice(NAME_PARTS[1]), rng.choice(NAME_PARTS[2])) if part)
+    reviews = 0 if rng.random() < 0.12 else int(rng.lognormvariate(3.0, 1.3))
+    # Ratings cluster at 4.5-5 and are missing for contractors without reviews
+    rating = None if reviews == 0 else round(min(5.0, max(1.0, 5 * rng.betavariate(9, 1.5))), 1)
+    return {
+        "name": name,
+        "rating": rating,
+        "reviews": reviews,
+        "phone": f"({rng.randint(201, 989)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}",
+        "city": city,
+        "state": state,
+        "postal_code": f"{zip_prefix}{rng.randint(0, 99):02d}",
+        "certifications": [cert for cert, share in CERTIFICATIONS if rng.random() < share],
+        "type": rng.choices(_type_names, weights=_type_weights)[0],
+        "contractor_id": f"SYN{seed:02d}{i:08d}",
+        "url": f"https://www.gaf.com/en-us/roofing-contractors/residential/syn-{seed}-{i}",
+    }
+
+def coveo_result(i, seed=0):
+    """Contractor ``i`` as one Coveo search result (the inverse of gaf_scraper.parse_results)."""
+    c = contractor(i, seed)
+    rng = random.Random(f"coveo:{seed}:{i}")
+    lat, lng = _city_coordinates[c["city"]]
+    return {
+        "title": c["name"],
+        "uri": c["url"],
+        "raw": {
+            "gaf_rating": c["rating"],
+            "gaf_number_of_reviews": c["reviews"],
+            "gaf_phone": c["phone"],
+            "gaf_f_city": c["city"],
+            "gaf_f_state_code": c["state"],
+            "gaf_postal_code": c["postal_code"],
+            "gaf_f_contractor_certifications_and_awards": c["certifications"],
+            "gaf_contractor_type": c["type"],
+            "gaf_contractor_id": c["contractor_id"],
+            "gaf_latitude": lat + rng.uniform(-0.3, 0.3),
+            "gaf_longitude": lng + rng.uniform(-0.3, 0.3),
+        },
+    }
+
+def generate_contractors(count, seed=0, start=0):
+    for i in range(start, start + count):
+        yield contractor(i, seed)
+
+def load_database(rows, seed=0, chunk_size=50000):
+    """Upsert ``rows`` synthetic contractors through etl.clean_and_insert, ``chunk_size`` at a time."""
+    from etl import clean_and_insert
+    totals = {"rows": rows, "inserted": 0, "updated": 0, "unchanged": 0}
+    started = time.perf_counter()
+    for offset in range(0, rows, chunk_size):
+        stats = clean_and_insert(list(generate_contractors(min(chunk_size, rows - offset), seed, offset)))
+        for key in ("inserted", "updated", "unchanged"):
+            totals[key] += stats[key]
+    totals["seconds"] = round(time.perf_counter() - started, 3)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--output", help="Write NDJSON here instead of loading the database")
+    args = parser.parse_args()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for c in generate_contractors(args.rows, args.seed):
+                f.write(json.dumps(c) + "\n")
+        print(json.dumps({"rows": args.rows, "output": args.output}))
+    else:
+        print(json.dumps(load_database(args.rows, args.seed, args.chunk_size)))
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,145 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
 import pydeck as pdk
+from requests.adapters import HTTPAdapter
 
 API_URL = "http://localhost:8000"
+API_PAGE_SIZE = 100  # /contractors maximum; larger limits are fetched page by page with the keyset cursor
+TABLE_PAGE_SIZE = 20
+MAP_LABEL_LIMIT = 500  # Text labels for more points than this only clutter the map and slow rendering
+DATA_VERSION_TTL = 5  # Seconds between /version checks
+MAP_VIEW_PX = (1200, 500)  # Approximate map size on screen; the viewport sent to /map/clusters is derived from it
+MAP_DEFAULT_CENTER = (39.8, -98.6)  # Continental US, used when no contractor has coordinates
+MAP_CLUSTER_RADIUS_M = 400  # Radius of a single-contractor cluster; larger clusters grow with sqrt(count)
+PRIORITY_LEVELS = {'high': 3, 'medium': 2, 'low': 1}  # priority_level values computed by the ETL
+PRIORITY_COLORS = {
+    'high': [34, 139, 34],  # 绿
+    'medium': [30, 144, 255],  # 蓝
+    'low': [148, 0, 211],  # 紫
+}
+UNKNOWN_COLOR = [128, 128, 128]  # 灰
+ROLE_SECTIONS = {
+    "Sales Rep": [("Business Summary", "business_summary"), ("Sales Tip", "sales_tip"), ("Risk Alert", "risk_alert"),
+                  ("Priority Suggestion", "priority_suggestion"), ("Next Action", "next_action")],
+    "Manager": [("Business Summary", "business_summary"), ("Priority Suggestion", "priority_suggestion"),
+                ("AI Scores", None), ("AI Comment", "evaluation_comment")],
+    "Business Analyst": [("Business Summary", "business_summary"), ("AI Insight", "insight"), ("AI Scores", None)],
+    "Other": [("Business Summary", "business_summary"), ("AI Insight", "insight")],
+}
+
+@st.cache_resource
+def get_http_session():
+    """One keep-alive HTTP session per server process, shared by all reruns and users."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def fetch_data_version():
+    try:
+        return get_http_session().get(f"{API_URL}/version", timeout=5).json()["data_version"]
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+def prepare_frame(data):
+    """DataFrame with map colors and tooltips computed column-wise rather than per row."""
+    df = pd.DataFrame(data)
+    if df.empty:
+        return df
+    level = df['priority_level'] if 'priority_level' in df else pd.Series(0, index=df.index)
+    conditions = [level == PRIORITY_LEVELS[name] for name in PRIORITY_COLORS]
+    colors = np.array(list(PRIORITY_COLORS.values()))
+    for i, channel in enumerate(['color_r', 'color_g', 'color_b']):
+        df[channel] = np.select(conditions, colors[:, i], default=UNKNOWN_COLOR[i])
+    text = df[['name', 'city', 'state', 'phone', 'rating', 'type', 'certifications', 'lead_score']].astype(object).fillna('').astype(str)
+    df['tooltip'] = (
+        text['name'] + ' (' + text['city'] + ', ' + text['state'] + ')\\n'
+        + 'Lead score: ' + text['lead_score'] + '\\n'
+        + 'Phone: ' + text['phone'] + '\\n'
+        + 'Rating: ' + text['rating'] + '\\n'
+        + 'Type: ' + text['type'] + '\\n'
+        + 'Cert: ' + text['certifications']
+    )
+    return df
+
+# Keyed on the filters and the API data version: reruns reuse the frame until the data changes
+@st.cache_data(show_spinner="Loading contractors...", max_entries=32)
+def load_contractors(params, limit, data_version):
+    session = get_http_session()
+    data, cursor = [], None
+    while len(data) < limit:
+        page_params = dict(params, limit=min(API_PAGE_SIZE, limit - len(data)))
+        if cursor:
+            page_params["cursor"] = cursor
+        resp = session.get(f"{API_URL}/contractors", params=page_params, timeout=30)
+        if resp.status_code != 200:
+            break
+        page = resp.json()
+        # 防御性检查：确保每一行都是dict，否则报错
+        if not all(isinstance(item, dict) for item in page):
+            raise ValueError("API返回数据格式错误：每一项应为dict。请检查后端API返回值。")
+        data.extend(page)
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    return prepare_frame(data)
+
+def map_viewport(lat, lng, zoom, width=MAP_VIEW_PX[0], height=MAP_VIEW_PX[1]):
+    """(min_lat, max_lat, min_lng, max_lng) visible around a center at a web-mercator zoom level."""
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_lng = width / 2 * deg_per_px
+    half_lat = height / 2 * deg_per_px * float(np.cos(np.radians(lat)))
+    return (max(lat - half_lat, -90.0), min(lat + half_lat, 90.0), max(lng - half_lng, -180.0), min(lng + half_lng, 180.0))
+
+def prepare_clusters(clusters, cell_size_deg):
+    """Cluster frame with the dominant priority's color, a radius growing with sqrt(count) and a tooltip."""
+    df = pd.DataFrame(clusters)
+    if df.empty:
+        return df
+    levels = list(PRIORITY_COLORS) + ['unknown']
+    counts = pd.DataFrame(df.pop('priority').tolist()).reindex(columns=levels, fill_value=0).fillna(0)
+    dominant = counts.to_numpy().argmax(axis=1)
+    colors = np.array(list(PRIORITY_COLORS.values()) + [UNKNOWN_COLOR])
+    for i, channel in enumerate(['color_r', 'color_g', 'color_b']):
+        df[channel] = colors[dominant, i]
+    # Never wider than half a grid cell, so neighbouring clusters do not overlap
+    max_radius = cell_size_deg * 111_000 / 2
+    df['radius'] = np.minimum(MAP_CLUSTER_RADIUS_M * np.sqrt(df['count']), max_radius)
+    df['label'] = df['count'].astype(str)
+    df['tooltip'] = (
+        df['label'] + ' contractors\\n'
+        + 'Avg rating: ' + df['avg_rating'].astype(object).fillna('').astype(str) + '\\n'
+        + 'High: ' + counts['high'].astype(str) + ', Medium: ' + counts['medium'].astype(str)
+        + ', Low: ' + counts['low'].astype(str) + ', Unknown: ' + counts['unknown'].astype(str)
+    )
+    return df
+
+def prepare_points(points):
+    df = pd.DataFrame(points)
+    if df.empty:
+        return df
+    colors = np.array([PRIORITY_COLORS.get(level, UNKNOWN_COLOR) for level in df['priority']])
+    for i, channel in enumerate(['color_r', 'color_g', 'color_b']):
+        df[channel] = colors[:, i]
+    text = df[['name', 'city', 'state', 'rating']].astype(object).fillna('').astype(str)
+    df['tooltip'] = text['name'] + ' (' + text['city'] + ', ' + text['state'] + ')\\n' + 'Rating: ' + text['rating']
+    return df
+
+# The server aggregates the viewport into at most a few hundred grid cells, so the payload depends on
+# the screen size and zoom rather than on how many contractors match
+@st.cache_data(show_spinner="Loading map...", max_entries=64)
+def load_map(params, viewport, zoom, data_version):
+    min_lat, max_lat, min_lng, max_lng = viewport
+    query = dict(params, min_lat=min_lat, max_lat=max_lat, min_lng=min_lng, max_lng=max_lng, zoom=zoom)
+    resp = get_http_session().get(f"{API_URL}/map/clusters", params=query, timeout=30)
+    resp.raise_for_status()
+    result = resp.json()
+    if result["mode"] == "points":
+        return result, prepare_points(result["points"])
+    return result, prepare_clusters(result["clusters"], result["cell_size_deg"])
 
 # 用户角色选择放最顶
 user_role = st.sidebar.selectbox("I am (User Role)", ["Sales Rep", "Manager", "Business Analyst", "Other"])
@@ -16,9 +152,12 @@ state = st.sidebar.text_input("State")
 min_rating = st.sidebar.number_input("Min Rating", min_value=0.0, max_value=5.0, step=0.1, value=0.0)
 max_rating = st.sidebar.number_input("Max Rating", min_value=0.0, max_value=5.0, step=0.1, value=5.0)
 certification = st.sidebar.text_input("Certification contains")
-order_by = st.sidebar.selectbox("Order by", [None, "rating", "reviews", "updated_at", "priority_suggestion"])
+min_score = st.sidebar.slider("Min lead score", min_value=0, max_value=100, value=0)
+order_by = st.sidebar.selectbox("Order by", [None, "lead_score", "rating", "reviews", "updated_at"])
 order_desc = st.sidebar.checkbox("Descending", value=True)
-limit = st.sidebar.slider("Limit", 1, 100, 20)
+limit = st.sidebar.select_slider("Limit", [10, 20, 50, 100, 500, 1000, 5000, 10000], value=20)
+map_zoom = st.sidebar.slider("Map zoom", min_value=3, max_value=16, value=5,
+                             help="Contractors are clustered below zoom 13 and shown individually from there on")
 
 params = {
     "city": city or None,
@@ -26,46 +165,32 @@ params = {
     "min_rating": min_rating if min_rating > 0 else None,
     "max_rating": max_rating if max_rating < 5 else None,
     "certification": certification or None,
+    "min_score": min_score or None,
     "order_by": order_by or None,
     "order_desc": order_desc,
-    "limit": limit,
 }
 params = {k: v for k, v in params.items() if v is not None}
 
-resp = requests.get(f"{API_URL}/contractors", params=params)
-data = resp.json() if resp.status_code == 200 else []
-df = pd.DataFrame(data)
-
-# 防御性检查：确保每一行都是dict，否则报错
-if not all(isinstance(item, dict) for item in data):
-    st.error("API返回数据格式错误：每一项应为dict。请检查后端API返回值。")
+try:
+    df = load_contractors(params, limit, fetch_data_version())
+except ValueError as e:
+    st.error(str(e))
+    st.stop()
+except requests.RequestException as e:
+    st.error(f"API request failed: {e}")
     st.stop()
 
 # 地图可视化
 st.subheader("Contractor Map")
-if not df.empty and 'latitude' in df and 'longitude' in df:
-    # priority颜色映射
-    def get_priority_color(priority):
-        if not isinstance(priority, str):
-            return [128,128,128]
-        p = priority.lower()
-        if 'high' in p:
-            return [34, 139, 34]  # 绿
-        elif 'medium' in p:
-            return [30, 144, 255]  # 蓝
-        elif 'low' in p:
-            return [148, 0, 211]  # 紫
-        else:
-            return [128,128,128]  # 灰
-    df_map = df.dropna(subset=['latitude','longitude']).copy()
-    df_map['color'] = df_map['priority_suggestion'].apply(get_priority_color)
-    df_map['tooltip'] = (
-        df_map['name'] + ' (' + df_map['city'] + ', ' + df_map['state'] + ')\\n'
-        + 'Phone: ' + df_map['phone'].astype(str) + '\\n'
-        + 'Rating: ' + df_map['rating'].astype(str) + '\\n'
-        + 'Type: ' + df_map['type'].astype(str) + '\\n'
-        + 'Cert: ' + df_map['certifications'].astype(str)
-    )
+df_map = df.dropna(subset=['latitude', 'longitude']) if not df.empty and 'latitude' in df and 'longitude' in df else pd.DataFrame()
+center = (df_map['latitude'].mean(), df_map['longitude'].mean()) if not df_map.empty else MAP_DEFAULT_CENTER
+map_params = {k: v for k, v in params.items() if k not in ("order_by", "order_desc")}
+try:
+    map_result, map_df = load_map(map_params, map_viewport(*center, map_zoom), map_zoom, fetch_data_version())
+except (requests.RequestException, ValueError) as e:
+    st.warning(f"Map data unavailable: {e}")
+    map_result, map_df = None, pd.DataFrame()
+if not map_df.empty:
     # 更新图例
     st.markdown("""
     <div style='font-size:14px;'>
@@ -76,34 +201,58 @@ if not df.empty and 'latitude' in df and 'longitude' in df:
     <span style='color:#888888;'>● Unknown</span>
     </div>
     """, unsafe_allow_html=True)
-    # pydeck图层，点半径更大，带文本
-    layer = pdk.Layer(
-        "ScatterplotLayer",
-        data=df_map,
-        get_position='[longitude, latitude]',
-        get_color='color',
-        get_radius=800,
-        pickable=True,
-        auto_highlight=True,
-    )
-    text_layer = pdk.Layer(
-        "TextLayer",
-        data=df_map,
-        get_position='[longitude, latitude]',
-        get_text='name',
-        get_size=14,
-        get_color=[40,40,40],
-        get_angle=0,
-        get_alignment_baseline="bottom",
-    )
+    if map_result["mode"] == "clusters":
+        st.caption(f"{map_result['total']} contractors in {len(map_df)} clusters (zoom {map_result['zoom']}); "
+                   "zoom in to see individual contractors")
+        layer = pdk.Layer(
+            "ScatterplotLayer",
+            data=map_df,
+            get_position='[lng, lat]',
+            get_color='[color_r, color_g, color_b, 180]',
+            get_radius='radius',
+            pickable=True,
+            auto_highlight=True,
+        )
+        text_layer = pdk.Layer(
+            "TextLayer",
+            data=map_df,
+            get_position='[lng, lat]',
+            get_text='label',
+            get_size=14,
+            get_color=[255, 255, 255],
+            get_alignment_baseline="center",
+        )
+    else:
+        if map_result.get("truncated"):
+            st.caption(f"Showing the first {len(map_df)} of {map_result['total']} contractors in view; narrow the filters to see the rest")
+        # pydeck图层，点半径更大，带文本
+        layer = pdk.Layer(
+            "ScatterplotLayer",
+            data=map_df,
+            get_position='[longitude, latitude]',
+            get_color='[color_r, color_g, color_b]',
+            get_radius=80,
+            pickable=True,
+            auto_highlight=True,
+        )
+        text_layer = pdk.Layer(
+            "TextLayer",
+            data=map_df,
+            get_position='[longitude, latitude]',
+            get_text='name',
+            get_size=14,
+            get_color=[40,40,40],
+            get_angle=0,
+            get_alignment_baseline="bottom",
+        )
     view_state = pdk.ViewState(
-        latitude=df_map['latitude'].mean(),
-        longitude=df_map['longitude'].mean(),
-        zoom=8,
+        latitude=center[0],
+        longitude=center[1],
+        zoom=map_zoom,
         pitch=0
     )
     # 获取当前位置（如有权限，可用st.session_state或geolocation API，这里用默认中心点）
-    user_lat, user_lng = df_map['latitude'].mean(), df_map['longitude'].mean()
+    user_lat, user_lng = center
     # 增加当前位置点（蓝色大点）
     user_layer = pdk.Layer(
         "ScatterplotLayer",
@@ -139,7 +288,7 @@ if not df.empty and 'latitude' in df and 'longitude' in df:
                 st.code(proposal)
         else:
             st.warning("No details found for the selected contractor.")
-    layers = [layer, text_layer, user_layer]
+    layers = [layer, text_layer, user_layer] if len(map_df) <= MAP_LABEL_LIMIT else [layer, user_layer]
     if highlight_layer:
         layers.append(highlight_layer)
     r = pdk.Deck(
@@ -151,56 +300,35 @@ if not df.empty and 'latitude' in df and 'longitude' in df:
 else:
     st.info("No location data available for map visualization.")
 
+def render_details(row):
+    # Show GAF website link
+    if row.get('url'):
+        st.markdown(f"[GAF Website]({row['url']})", unsafe_allow_html=True)
+    # Show insights based on user role
+    for title, field in ROLE_SECTIONS.get(user_role, ROLE_SECTIONS["Other"]):
+        st.markdown(f"<h4><b>{title}</b></h4>", unsafe_allow_html=True)
+        if field is None:
+            body = (f"Relevance: {row.get('relevance_score', '')}, Actionability: {row.get('actionability_score', '')}, "
+                    f"Accuracy: {row.get('accuracy_score', '')}, Clarity: {row.get('clarity_score', '')}")
+        else:
+            body = row.get(field, '')
+        st.markdown(f"<div style='font-size:16px'>{body}</div>", unsafe_allow_html=True)
+
 st.subheader("Contractor Table")
 if not df.empty:
-    for idx, row in df.iterrows():
-        # 防御性：如果row不是Series或dict，跳过
-        if not (isinstance(row, pd.Series) or isinstance(row, dict)):
-            continue
+    # The grid is virtualized by Streamlit; only the current page gets per-contractor expanders
+    st.dataframe(df[['name', 'city', 'state', 'rating', 'reviews', 'priority_suggestion', 'phone']], use_container_width=True, hide_index=True)
+    pages = max(1, -(-len(df) // TABLE_PAGE_SIZE))
+    page = st.number_input(f"Details page (of {pages})", min_value=1, max_value=pages, value=1, step=1) - 1
+    for row in df.iloc[page * TABLE_PAGE_SIZE:(page + 1) * TABLE_PAGE_SIZE].to_dict("records"):
         with st.expander(f"{row['name']} ({row['city']}, {row['state']})"):
-            # Show GAF website link
-            if row.get('url'):
-                st.markdown(f"[GAF Website]({row['url']})", unsafe_allow_html=True)
-            # Show insights based on user role
-            if user_role == "Sales Rep":
-                st.markdown("<h4><b>Business Summary</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('business_summary', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>Sales Tip</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('sales_tip', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>Risk Alert</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('risk_alert', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>Priority Suggestion</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('priority_suggestion', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>Next Action</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('next_action', '')}</div>", unsafe_allow_html=True)
-            elif user_role == "Manager":
-                st.markdown("<h4><b>Business Summary</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('business_summary', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>Priority Suggestion</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('priority_suggestion', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>AI Scores</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>Relevance: {row.get('relevance_score', '')}, Actionability: {row.get('actionability_score', '')}, Accuracy: {row.get('accuracy_score', '')}, Clarity: {row.get('clarity_score', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>AI Comment</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('evaluation_comment', '')}</div>", unsafe_allow_html=True)
-            elif user_role == "Business Analyst":
-                st.markdown("<h4><b>Business Summary</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('business_summary', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>AI Insight</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('insight', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>AI Scores</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>Relevance: {row.get('relevance_score', '')}, Actionability: {row.get('actionability_score', '')}, Accuracy: {row.get('accuracy_score', '')}, Clarity: {row.get('clarity_score', '')}</div>", unsafe_allow_html=True)
-            else:
-                st.markdown("<h4><b>Business Summary</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('business_summary', '')}</div>", unsafe_allow_html=True)
-                st.markdown("<h4><b>AI Insight</b></h4>", unsafe_allow_html=True)
-                st.markdown(f"<div style='font-size:16px'>{row.get('insight', '')}</div>", unsafe_allow_html=True)
-            # GAF官网链接已在上方显示
+            render_details(row)
 else:
     st.info("No contractors found for the current filters.")
 
 # Export button
 if st.button("Export as CSV"):
-    export_resp = requests.get(f"{API_URL}/export", params=params)
+    export_resp = get_http_session().get(f"{API_URL}/export", params=params, timeout=300)
     if export_resp.status_code == 200:
         st.download_button(
             label="Download CSV",
@@ -213,5 +341,5 @@ if st.button("Export as CSV"):
 
 # 仅Other角色显示调试信息
 if user_role == "Other":
-    st.write("Raw API data:", data)
+    st.write("Raw API data:", df.head(TABLE_PAGE_SIZE))
     st.write("DataFrame columns:", df.columns) 
\ No newline at end of file
@@ -1,39 +1,170 @@
+import ast
+import csv
+import functools
+import hashlib
 import json
 import os
-from models import Contractor, Session
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from models import Contractor, GeocodeCache, Session, parse_certifications, sync_certifications, bump_data_version, update_lead_scores
+from sqlalchemy import select, bindparam, func, literal
+from llm import chat_completion, estimate_tokens, run_pool, LLM_CONCURRENCY, LLM_COMMIT_EVERY
+import metrics
 import openai
 import logging
 from geopy.geocoders import Nominatim
 import time
 
-def clean_and_insert(contractors):
-    session = Session()
+SCRAPED_FIELDS = ("name", "rating", "reviews", "phone", "city", "state", "postal_code", "certifications", "type", "url")
+UPSERT_CHUNK_SIZE = 500
+# Fields that feed the LLM prompts; a change to any of them makes the generated outputs stale
+FINGERPRINT_FIELDS = ("name", "rating", "reviews", "phone", "city", "state", "postal_code", "certifications", "type")
+# Bump a version whenever its prompt changes so that stored outputs are regenerated
+INSIGHT_PROMPT_VERSION = "insight-v1"
+IMPROVED_INSIGHT_PROMPT_VERSION = "insight-improved-v1"
+EVALUATION_PROMPT_VERSION = "evaluation-v1"
+MULTI_INSIGHT_PROMPT_VERSION = "multi-v1"
+
+def _clean_record(c):
+    c = dict(c)
+    c['name'] = c['name'].strip() if c.get('name') else None
+    c['certifications'] = json.dumps(c.get('certifications') or [])
+    return c
+
+def source_fingerprint(values):
+    """Stable hash of the scraped fields that feed the prompts."""
+    normalized = []
+    for f in FINGERPRINT_FIELDS:
+        v = values.get(f)
+        # 4 and 4.0 must hash the same whether they come from the scraper or the database
+        normalized.append(float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v)
+    payload = json.dumps(normalized, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def bulk_upsert_contractors(session, records, chunk_size=UPSERT_CHUNK_SIZE):
+    """Insert new contractors and refresh the scraped fields of changed ones, one chunk at a time.
+
+    Existing rows are resolved with a single ``contractor_id IN (...)`` lookup per chunk, then new
+    rows are written with one executemany INSERT and changed rows with one executemany UPDATE.
+    Returns per-batch counts, the ids of inserted and updated rows and a timing breakdown; the caller owns the commit.
+    """
+    table = Contractor.__table__
+    update_stmt = table.update().where(table.c.id == bindparam('_id')).values(
+        {f: bindparam(f) for f in SCRAPED_FIELDS + ("source_fingerprint",)}
+    )
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0, "inserted_ids": [], "updated_ids": [], "batches": [],
+             "timings": {"lookup": 0.0, "insert": 0.0, "update": 0.0, "certifications": 0.0}}
+    for offset in range(0, len(records), chunk_size):
+        chunk = records[offset:offset + chunk_size]
+        batch_start = time.perf_counter()
+        t0 = time.perf_counter()
+        existing = {
+            row.contractor_id: row
+            for row in session.execute(
+                select(table.c.id, table.c.contractor_id, *[table.c[f] for f in SCRAPED_FIELDS])
+                .where(table.c.contractor_id.in_([c['contractor_id'] for c in chunk]))
+            )
+        }
+        t1 = time.perf_counter()
+        inserts, updates = [], []
+        unchanged = 0
+        for c in chunk:
+            values = {f: c.get(f) for f in SCRAPED_FIELDS}
+            values["source_fingerprint"] = source_fingerprint(values)
+            row = existing.get(c['contractor_id'])
+            if row is None:
+                inserts.append(dict(values, contractor_id=c['contractor_id']))
+            elif any(getattr(row, f) != values[f] for f in SCRAPED_FIELDS):
+                updates.append(dict(values, _id=row.id))
+            else:
+                unchanged += 1
+        if inserts:
+            session.execute(table.insert(), inserts)
+        t2 = time.perf_counter()
+        if updates:
+            session.execute(update_stmt, updates)
+        t3 = time.perf_counter()
+        certifications = {u["_id"]: parse_certifications(u["certifications"]) for u in updates}
+        if inserts:
+            new_ids = session.execute(
+                select(table.c.contractor_id, table.c.id).where(table.c.contractor_id.in_([i["contractor_id"] for i in inserts]))
+            ).all()
+            by_contractor_id = {i["contractor_id"]: i for i in inserts}
+            certifications.update(
+                (row.id, parse_certifications(by_contractor_id[row.contractor_id]["certifications"])) for row in new_ids
+            )
+            stats["inserted_ids"].extend(row.id for row in new_ids)
+        stats["updated_ids"].extend(u["_id"] for u in updates)
+        sync_certifications(session, certifications)
+        t4 = time.perf_counter()
+        stats["timings"]["lookup"] += t1 - t0
+        stats["timings"]["insert"] += t2 - t1
+        stats["timings"]["update"] += t3 - t2
+        stats["timings"]["certifications"] += t4 - t3
+        stats["inserted"] += len(inserts)
+        stats["updated"] += len(updates)
+        stats["unchanged"] += unchanged
+        stats["batches"].append({
+            "size": len(chunk),
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "unchanged": unchanged,
+            "seconds": round(time.perf_counter() - batch_start, 4),
+        })
+    return stats
+
+@metrics.stage("upsert")
+def clean_and_insert(contractors, chunk_size=UPSERT_CHUNK_SIZE):
+    start = time.perf_counter()
     missing_name = 0
     missing_rating = 0
     missing_phone = 0
     missing_cert = 0
+    missing_id = 0
+    records = {}
     for c in contractors:
         # Data cleaning
-        c['name'] = c['name'].strip() if c['name'] else None
-        c['certifications'] = json.dumps(c['certifications'] or [])
+        c = _clean_record(c)
         # Data quality checks
         if not c['name']:
             missing_name += 1
-        if not c['rating']:
+        if not c.get('rating'):
             missing_rating += 1
-        if not c['phone']:
+        if not c.get('phone'):
             missing_phone += 1
         if not c['certifications'] or c['certifications'] == '[]':
             missing_cert += 1
-        # Duplicate check
-        if session.query(Contractor).filter_by(contractor_id=c['contractor_id']).first():
+        if not c.get('contractor_id'):
+            missing_id += 1
             continue
-        contractor = Contractor(**c)
-        session.add(contractor)
-    session.commit()
-    session.close()
-    logging.info(f"{len(contractors)} records collected and inserted into the database")
-    logging.info(f"Missing name: {missing_name}, missing rating: {missing_rating}, missing phone: {missing_phone}, missing certifications: {missing_cert}")
+        # Duplicate check: the last occurrence of a contractor_id in a crawl wins
+        records[c['contractor_id']] = c
+    clean_seconds = time.perf_counter() - start
+    session = Session()
+    try:
+        stats = bulk_upsert_contractors(session, list(records.values()), chunk_size=chunk_size)
+        t0 = time.perf_counter()
+        update_lead_scores(session, stats["inserted_ids"] + stats["updated_ids"])
+        stats["timings"]["scores"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        if stats["inserted"] or stats["updated"]:
+            bump_data_version(session)
+        session.commit()
+        stats["timings"]["commit"] = time.perf_counter() - t0
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    stats["timings"]["clean"] = clean_seconds
+    stats["timings"]["total"] = time.perf_counter() - start
+    stats["timings"] = {k: round(v, 4) for k, v in stats["timings"].items()}
+    stats["collected"] = len(contractors)
+    logging.info(f"{len(contractors)} records collected: {stats['inserted']} inserted, {stats['updated']} updated, {stats['unchanged']} unchanged")
+    logging.info(f"Missing name: {missing_name}, missing rating: {missing_rating}, missing phone: {missing_phone}, missing certifications: {missing_cert}, missing contractor_id: {missing_id}")
+    logging.info(f"Upsert timings (s): {stats['timings']}")
+    return stats
 
 openai.api_key = os.environ.get("OPENAI_API_KEY")
 
@@ -50,39 +181,109 @@ INSIGHT_PROMPT = (
     "Type: {type}\n"
 )
 
-def generate_insight(contractor):
-    prompt = INSIGHT_PROMPT.format(**contractor)
-    response = openai.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=200,
-        temperature=0.7,
+def _commit_changes(session):
+    """Commit a job batch, rescoring the contractors it modified and bumping the data version if there were any."""
+    # Rows changed by on_result are still pending here: nothing flushes between batches
+    if session.dirty or session.new:
+        changed = [obj for obj in list(session.dirty) + list(session.new) if isinstance(obj, Contractor)]
+        session.flush()
+        update_lead_scores(session, [c.id for c in changed])
+        bump_data_version(session)
+    session.commit()
+
+def _versioned(version, fingerprint_column):
+    """SQL expression for the output fingerprint ``"<version>:<fingerprint>"``."""
+    return literal(f"{version}:") + func.coalesce(fingerprint_column, "")
+
+def _is_stale(fingerprint_column, *current):
+    return (fingerprint_column == None) | fingerprint_column.notin_(list(current))
+
+def refresh_fingerprints(session):
+    """Backfill source fingerprints for rows stored before fingerprinting existed.
+
+    Outputs already present on those rows are adopted as produced by the current prompt versions,
+    so upgrading an existing database does not regenerate everything.
+    """
+    table = Contractor.__table__
+    rows = session.execute(
+        select(table.c.id, *[table.c[f] for f in FINGERPRINT_FIELDS]).where(table.c.source_fingerprint == None)
+    ).all()
+    if not rows:
+        return 0
+    session.execute(
+        table.update().where(table.c.id == bindparam('_id')).values(source_fingerprint=bindparam('fingerprint')),
+        [{"_id": row.id, "fingerprint": source_fingerprint(row._mapping)} for row in rows],
+    )
+    session.execute(
+        table.update()
+        .where(table.c.insight_fingerprint == None, table.c.insight != None, table.c.insight != "")
+        .values(insight_fingerprint=_versioned(INSIGHT_PROMPT_VERSION, table.c.source_fingerprint))
     )
-    return response.choices[0].message.content.strip()
+    session.execute(
+        table.update()
+        .where(table.c.multi_insights_fingerprint == None,
+               *[(table.c[f] != None) & (table.c[f] != "") for f in MULTI_INSIGHT_FIELDS])
+        .values(multi_insights_fingerprint=_versioned(MULTI_INSIGHT_PROMPT_VERSION, table.c.source_fingerprint))
+    )
+    session.execute(
+        table.update()
+        .where(table.c.evaluation_fingerprint == None, table.c.insight_fingerprint != None,
+               *[table.c[f] != None for f in ("relevance_score", "actionability_score", "accuracy_score", "clarity_score")])
+        .values(evaluation_fingerprint=_versioned(EVALUATION_PROMPT_VERSION, table.c.insight_fingerprint))
+    )
+    logging.info(f"Backfilled source fingerprints for {len(rows)} contractors")
+    return len(rows)
 
-def update_insights():
+def _contractor_dict(c):
+    return {
+        "name": c.name or "",
+        "rating": c.rating or "N/A",
+        "reviews": c.reviews or "N/A",
+        "phone": c.phone or "N/A",
+        "city": c.city or "N/A",
+        "state": c.state or "N/A",
+        "postal_code": c.postal_code or "N/A",
+        "certifications": c.certifications or "N/A",
+        "type": c.type or "N/A",
+    }
+
+def generate_insight(contractor, bypass_cache=False):
+    prompt = INSIGHT_PROMPT.format(**contractor)
+    return chat_completion(prompt, max_tokens=200, temperature=0.7, bypass_cache=bypass_cache, prompt_type="insight").text
+
+@metrics.stage("insights")
+def update_insights(concurrency=LLM_CONCURRENCY, batch_size=LLM_COMMIT_EVERY, bypass_cache=False, ids=None):
+    """Generate insights for contractors that have none, or whose scraped data changed since theirs was generated."""
     session = Session()
-    contractors = session.query(Contractor).filter((Contractor.insight == None) | (Contractor.insight == "")).all()
-    for c in contractors:
-        contractor_dict = {
-            "name": c.name or "",
-            "rating": c.rating or "N/A",
-            "reviews": c.reviews or "N/A",
-            "phone": c.phone or "N/A",
-            "city": c.city or "N/A",
-            "state": c.state or "N/A",
-            "postal_code": c.postal_code or "N/A",
-            "certifications": c.certifications or "N/A",
-            "type": c.type or "N/A",
-        }
-        try:
-            insight = generate_insight(contractor_dict)
-            c.insight = insight
-            print(f"Insight generated: {c.name}")
-        except Exception as e:
-            print(f"Insight generation failed: {c.name}, Error: {e}")
+    refresh_fingerprints(session)
     session.commit()
-    session.close()
+    query = session.query(Contractor).filter(
+        (Contractor.insight == None) | (Contractor.insight == "") |
+        _is_stale(Contractor.insight_fingerprint,
+                  _versioned(INSIGHT_PROMPT_VERSION, Contractor.source_fingerprint),
+                  _versioned(IMPROVED_INSIGHT_PROMPT_VERSION, Contractor.source_fingerprint))
+    )
+    if ids is not None:
+        query = query.filter(Contractor.id.in_(ids))
+    contractors = query.all()
+
+    def on_result(item, insight, error):
+        c, contractor_dict, fingerprint = item
+        if error:
+            print(f"Insight generation failed: {contractor_dict['name']}, Error: {error}")
+            return
+        c.insight = insight
+        c.insight_fingerprint = fingerprint
+        print(f"Insight generated: {contractor_dict['name']}")
+
+    try:
+        return run_pool(
+            [(c, _contractor_dict(c), f"{INSIGHT_PROMPT_VERSION}:{c.source_fingerprint}") for c in contractors],
+            lambda item: generate_insight(item[1], bypass_cache),
+            on_result, on_batch=lambda: _commit_changes(session), concurrency=concurrency, batch_size=batch_size,
+        )
+    finally:
+        session.close()
 
 EVALUATION_PROMPT = (
     "You are a sales enablement expert. Please evaluate the following AI-generated sales insight for a contractor based on the contractor's information. Score the insight on a scale of 1-5 for each of the following criteria: relevance, actionability, accuracy, and clarity. Also, provide a brief comment.\n"
@@ -93,41 +294,69 @@ EVALUATION_PROMPT = (
     '{{"relevance": 5, "actionability": 4, "accuracy": 5, "clarity": 5, "comment": "This insight is actionable and relevant."}}'
 )
 
-def evaluate_insights():
-    """Batch evaluate all contractors with an AI insight but no evaluation scores. Update the evaluation fields in the database."""
-    import json
-    import ast
+EVALUATION_SCORE_KEYS = ("relevance", "actionability", "accuracy", "clarity")
+
+def evaluate_insight(contractor_info, insight, bypass_cache=False):
+    """Ask the LLM to score one insight; returns integer scores and the comment.
+
+    Raises ValueError for a response that is not a score object, so run_pool counts it as failed.
+    """
+    prompt = EVALUATION_PROMPT.format(contractor_info=contractor_info, insight=insight)
+    result = chat_completion(prompt, max_tokens=200, temperature=0.3, bypass_cache=bypass_cache, prompt_type="evaluation").text
+    try:
+        data = json.loads(result)
+    except Exception:
+        data = ast.literal_eval(result)
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object of scores, got {type(data).__name__}")
+    try:
+        scores = {key: int(data.get(key, 0)) for key in EVALUATION_SCORE_KEYS}
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid score in evaluation response: {e}") from e
+    scores["comment"] = data.get("comment", "")
+    return scores
+
+@metrics.stage("evaluation")
+def evaluate_insights(concurrency=LLM_CONCURRENCY, batch_size=LLM_COMMIT_EVERY, bypass_cache=False, ids=None):
+    """Batch evaluate all contractors with an AI insight but no evaluation scores, or whose insight changed since it was scored. Update the evaluation fields in the database."""
     session = Session()
-    contractors = session.query(Contractor).filter(
+    refresh_fingerprints(session)
+    session.commit()
+    query = session.query(Contractor).filter(
         Contractor.insight != None,
         (Contractor.relevance_score == None) | (Contractor.actionability_score == None) |
-        (Contractor.accuracy_score == None) | (Contractor.clarity_score == None)
-    ).all()
-    for c in contractors:
-        contractor_info = f"Name: {c.name}, Rating: {c.rating}, Reviews: {c.reviews}, Phone: {c.phone}, City: {c.city}, State: {c.state}, Postal Code: {c.postal_code}, Certifications: {c.certifications}, Type: {c.type}"
-        prompt = EVALUATION_PROMPT.format(contractor_info=contractor_info, insight=c.insight)
-        try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200,
-                temperature=0.3,
-            )
-            result = response.choices[0].message.content.strip()
-            try:
-                result_dict = json.loads(result)
-            except Exception:
-                result_dict = ast.literal_eval(result)
-            c.relevance_score = int(result_dict.get('relevance', 0))
-            c.actionability_score = int(result_dict.get('actionability', 0))
-            c.accuracy_score = int(result_dict.get('accuracy', 0))
-            c.clarity_score = int(result_dict.get('clarity', 0))
-            c.evaluation_comment = result_dict.get('comment', '')
-            print(f"Evaluated: {c.name}")
-        except Exception as e:
-            print(f"Evaluation failed: {c.name}, Error: {e}")
-    session.commit()
-    session.close()
+        (Contractor.accuracy_score == None) | (Contractor.clarity_score == None) |
+        _is_stale(Contractor.evaluation_fingerprint, _versioned(EVALUATION_PROMPT_VERSION, Contractor.insight_fingerprint))
+    )
+    if ids is not None:
+        query = query.filter(Contractor.id.in_(ids))
+    contractors = query.all()
+    items = [
+        (c, c.name, f"Name: {c.name}, Rating: {c.rating}, Reviews: {c.reviews}, Phone: {c.phone}, City: {c.city}, State: {c.state}, Postal Code: {c.postal_code}, Certifications: {c.certifications}, Type: {c.type}", c.insight,
+         f"{EVALUATION_PROMPT_VERSION}:{c.insight_fingerprint or ''}")
+        for c in contractors
+    ]
+
+    def on_result(item, scores, error):
+        c, name, fingerprint = item[0], item[1], item[4]
+        if error:
+            print(f"Evaluation failed: {name}, Error: {error}")
+            return
+        c.relevance_score = scores['relevance']
+        c.actionability_score = scores['actionability']
+        c.accuracy_score = scores['accuracy']
+        c.clarity_score = scores['clarity']
+        c.evaluation_comment = scores['comment']
+        c.evaluation_fingerprint = fingerprint
+        print(f"Evaluated: {name}")
+
+    try:
+        return run_pool(
+            items, lambda item: evaluate_insight(item[2], item[3], bypass_cache),
+            on_result, on_batch=lambda: _commit_changes(session), concurrency=concurrency, batch_size=batch_size,
+        )
+    finally:
+        session.close()
 
 IMPROVED_INSIGHT_PROMPT = (
     "Based on the following contractor information, generate a concise, actionable, and differentiated sales insight in English. Avoid generic statements and focus on unique value or opportunities for engagement.\n"
@@ -142,41 +371,47 @@ IMPROVED_INSIGHT_PROMPT = (
     "Type: {type}\n"
 )
 
-def regenerate_low_score_insights():
+def generate_improved_insight(contractor, bypass_cache=False):
+    prompt = IMPROVED_INSIGHT_PROMPT.format(**contractor)
+    return chat_completion(prompt, max_tokens=200, temperature=0.7, bypass_cache=bypass_cache, prompt_type="improved_insight").text
+
+@metrics.stage("regenerate_insights")
+def regenerate_low_score_insights(concurrency=LLM_CONCURRENCY, batch_size=LLM_COMMIT_EVERY, bypass_cache=True, ids=None):
+    """Regenerate insights whose current scores are low, unless they were already regenerated for the same data."""
+    # Regeneration is deliberate: by default skip cached answers that already scored low
     session = Session()
-    contractors = session.query(Contractor).filter(
+    refresh_fingerprints(session)
+    session.commit()
+    query = session.query(Contractor).filter(
         (Contractor.relevance_score <= 2) |
         (Contractor.actionability_score <= 2) |
         (Contractor.accuracy_score <= 2) |
-        (Contractor.clarity_score <= 2)
-    ).all()
-    for c in contractors:
-        contractor_dict = {
-            "name": c.name or "",
-            "rating": c.rating or "N/A",
-            "reviews": c.reviews or "N/A",
-            "phone": c.phone or "N/A",
-            "city": c.city or "N/A",
-            "state": c.state or "N/A",
-            "postal_code": c.postal_code or "N/A",
-            "certifications": c.certifications or "N/A",
-            "type": c.type or "N/A",
-        }
-        try:
-            prompt = IMPROVED_INSIGHT_PROMPT.format(**contractor_dict)
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200,
-                temperature=0.7,
-            )
-            improved_insight = response.choices[0].message.content.strip()
-            c.insight = improved_insight
-            print(f"Regenerated improved insight: {c.name}")
-        except Exception as e:
-            print(f"Insight regeneration failed: {c.name}, Error: {e}")
-    session.commit()
-    session.close()
+        (Contractor.clarity_score <= 2),
+        # Scores must belong to the current insight
+        Contractor.evaluation_fingerprint == _versioned(EVALUATION_PROMPT_VERSION, Contractor.insight_fingerprint),
+        _is_stale(Contractor.insight_fingerprint, _versioned(IMPROVED_INSIGHT_PROMPT_VERSION, Contractor.source_fingerprint)),
+    )
+    if ids is not None:
+        query = query.filter(Contractor.id.in_(ids))
+    contractors = query.all()
+
+    def on_result(item, improved_insight, error):
+        c, contractor_dict, fingerprint = item
+        if error:
+            print(f"Insight regeneration failed: {contractor_dict['name']}, Error: {error}")
+            return
+        c.insight = improved_insight
+        c.insight_fingerprint = fingerprint
+        print(f"Regenerated improved insight: {contractor_dict['name']}")
+
+    try:
+        return run_pool(
+            [(c, _contractor_dict(c), f"{IMPROVED_INSIGHT_PROMPT_VERSION}:{c.source_fingerprint}") for c in contractors],
+            lambda item: generate_improved_insight(item[1], bypass_cache),
+            on_result, on_batch=lambda: _commit_changes(session), concurrency=concurrency, batch_size=batch_size,
+        )
+    finally:
+        session.close()
 
 BUSINESS_SUMMARY_PROMPT = (
     "Given the following contractor data, summarize their business scale and activity level. Highlight any recent major projects or news if available.\n"
@@ -229,79 +464,315 @@ NEXT_ACTION_PROMPT = (
     "Type: {type}\n"
 )
 
-def generate_multi_insights(contractor):
-    prompts = [
-        ("business_summary", BUSINESS_SUMMARY_PROMPT),
-        ("sales_tip", SALES_TIP_PROMPT),
-        ("risk_alert", RISK_ALERT_PROMPT),
-        ("priority_suggestion", PRIORITY_SUGGESTION_PROMPT),
-        ("next_action", NEXT_ACTION_PROMPT),
-    ]
+MULTI_INSIGHT_PROMPTS = [
+    ("business_summary", BUSINESS_SUMMARY_PROMPT),
+    ("sales_tip", SALES_TIP_PROMPT),
+    ("risk_alert", RISK_ALERT_PROMPT),
+    ("priority_suggestion", PRIORITY_SUGGESTION_PROMPT),
+    ("next_action", NEXT_ACTION_PROMPT),
+]
+
+MULTI_INSIGHT_FIELDS = [field for field, _ in MULTI_INSIGHT_PROMPTS]
+MULTI_INSIGHT_MODE = os.environ.get("MULTI_INSIGHT_MODE", "structured")  # "structured" or "per_field"
+
+STRUCTURED_MULTI_INSIGHT_PROMPT = (
+    "You are preparing a sales rep for outreach to the contractor below. Respond with a single JSON object with exactly these string keys:\n"
+    '"business_summary": summarize their business scale and activity level, highlighting any recent major projects or news if available.\n'
+    '"sales_tip": a personalized sales talking point and a recommended opening line for a sales call.\n'
+    '"risk_alert": any negative trends or risks in their ratings and reviews, and how a sales rep should address them.\n'
+    '"priority_suggestion": how high a priority they should be for sales outreach, starting with High, Medium or Low, and why.\n'
+    '"next_action": the next best action for a sales rep (e.g., call, email, send brochure) and the best time to contact.\n'
+    "Use double quotes for all keys and string values, and do not include trailing commas.\n"
+    "Company Name: {name}\n"
+    "Rating: {rating}\n"
+    "Reviews: {reviews}\n"
+    "City: {city}\n"
+    "State: {state}\n"
+    "Certifications: {certifications}\n"
+    "Type: {type}\n"
+)
+
+def validate_multi_insights(data):
+    """Return the fields of a structured response that pass validation, and the names of those that do not."""
+    valid = {}
+    if isinstance(data, dict):
+        for field in MULTI_INSIGHT_FIELDS:
+            value = data.get(field)
+            if not isinstance(value, str) or not value.strip():
+                continue
+            if field == "priority_suggestion" and not re.search(r"\b(high|medium|low)\b", value, re.IGNORECASE):
+                continue
+            valid[field] = value.strip()
+    return valid, [field for field in MULTI_INSIGHT_FIELDS if field not in valid]
+
+def _new_usage():
+    return {"calls": 0, "cache_hits": 0, "prompt_tokens": 0, "completion_tokens": 0, "baseline_prompt_tokens": 0, "fallback_fields": 0,
+            "combined_calls": 0}
+
+def _add_usage(usage, completion):
+    if completion.cached:
+        usage["cache_hits"] += 1
+        return
+    usage["calls"] += 1
+    usage["prompt_tokens"] += completion.prompt_tokens
+    usage["completion_tokens"] += completion.completion_tokens
+
+def _generate_multi_per_field(contractor, fields, usage, bypass_cache=False):
     results = {}
-    for field, prompt_template in prompts:
+    for field, prompt_template in MULTI_INSIGHT_PROMPTS:
+        if field not in fields:
+            continue
         prompt = prompt_template.format(**contractor)
         try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200,
-                temperature=0.7,
-            )
-            results[field] = response.choices[0].message.content.strip()
+            completion = chat_completion(prompt, max_tokens=200, temperature=0.7, bypass_cache=bypass_cache,
+                                         prompt_type=f"multi_insight:{field}")
+            _add_usage(usage, completion)
+            results[field] = completion.text
         except Exception as e:
             results[field] = f"[Error generating {field}: {e}]"
     return results
 
-def update_multi_insights():
+def generate_multi_insights(contractor, bypass_cache=False):
+    return _generate_multi_per_field(contractor, MULTI_INSIGHT_FIELDS, _new_usage(), bypass_cache)
+
+def generate_multi_insights_structured(contractor, bypass_cache=False):
+    """Generate all five insights with one JSON-mode call; fields that fail validation fall back to per-field calls.
+
+    Returns ``(results, usage)`` where ``usage`` counts the calls and tokens actually spent, plus the
+    estimated prompt tokens the five per-field prompts would have cost.
+    """
+    usage = _new_usage()
+    usage["baseline_prompt_tokens"] = sum(
+        estimate_tokens(prompt_template.format(**contractor)) for _, prompt_template in MULTI_INSIGHT_PROMPTS
+    )
+    results, invalid = {}, MULTI_INSIGHT_FIELDS
+    try:
+        completion = chat_completion(
+            STRUCTURED_MULTI_INSIGHT_PROMPT.format(**contractor),
+            max_tokens=700,
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            bypass_cache=bypass_cache,
+            prompt_type="multi_insight_structured",
+        )
+        _add_usage(usage, completion)
+        results, invalid = validate_multi_insights(json.loads(completion.text))
+        usage["combined_calls"] = 1
+    except Exception as e:
+        logging.warning(f"Structured multi-insight call failed for {contractor['name']}: {e}")
+    if invalid:
+        usage["fallback_fields"] += len(invalid)
+        results.update(_generate_multi_per_field(contractor, invalid, usage, bypass_cache))
+    return results, usage
+
+@metrics.stage("multi_insights")
+def update_multi_insights(mode=MULTI_INSIGHT_MODE, concurrency=LLM_CONCURRENCY, batch_size=LLM_COMMIT_EVERY, bypass_cache=False, ids=None):
+    """Fill in the five multi-insight fields where missing or generated from older data.
+
+    ``mode`` is "structured" (one JSON call per contractor) or "per_field".
+    """
+    if mode not in ("structured", "per_field"):
+        raise ValueError(f"Unknown multi-insight mode: {mode}")
     session = Session()
-    contractors = session.query(Contractor).filter(
+    refresh_fingerprints(session)
+    session.commit()
+    query = session.query(Contractor).filter(
         (Contractor.business_summary == None) | (Contractor.business_summary == "") |
         (Contractor.sales_tip == None) | (Contractor.sales_tip == "") |
         (Contractor.risk_alert == None) | (Contractor.risk_alert == "") |
         (Contractor.priority_suggestion == None) | (Contractor.priority_suggestion == "") |
-        (Contractor.next_action == None) | (Contractor.next_action == "")
-    ).all()
-    for c in contractors:
-        contractor_dict = {
-            "name": c.name or "",
-            "rating": c.rating or "N/A",
-            "reviews": c.reviews or "N/A",
-            "phone": c.phone or "N/A",
-            "city": c.city or "N/A",
-            "state": c.state or "N/A",
-            "postal_code": c.postal_code or "N/A",
-            "certifications": c.certifications or "N/A",
-            "type": c.type or "N/A",
-        }
-        try:
-            insights = generate_multi_insights(contractor_dict)
-            c.business_summary = insights["business_summary"]
-            c.sales_tip = insights["sales_tip"]
-            c.risk_alert = insights["risk_alert"]
-            c.priority_suggestion = insights["priority_suggestion"]
-            c.next_action = insights["next_action"]
-            print(f"Multi-insights generated: {c.name}")
-        except Exception as e:
-            print(f"Multi-insight generation failed: {c.name}, Error: {e}")
-    session.commit()
-    session.close()
+        (Contractor.next_action == None) | (Contractor.next_action == "") |
+        _is_stale(Contractor.multi_insights_fingerprint, _versioned(MULTI_INSIGHT_PROMPT_VERSION, Contractor.source_fingerprint))
+    )
+    if ids is not None:
+        query = query.filter(Contractor.id.in_(ids))
+    contractors = query.all()
+    totals = _new_usage()
+    calls_saved = 0
 
-def geocode_and_update_latlng():
-    session = Session()
-    geolocator = Nominatim(user_agent="gaf_sales_platform")
-    contractors = session.query(Contractor).filter((Contractor.latitude == None) | (Contractor.longitude == None)).all()
-    for c in contractors:
-        address = f"{c.city or ''}, {c.state or ''}, {c.postal_code or ''}".strip(', ')
-        try:
-            location = geolocator.geocode(address, timeout=10)
-            if location:
-                c.latitude = location.latitude
-                c.longitude = location.longitude
-                print(f"Geocoded: {c.name} -> ({c.latitude}, {c.longitude})")
+    def work(item):
+        contractor_dict = item[1]
+        if mode == "structured":
+            return generate_multi_insights_structured(contractor_dict, bypass_cache)
+        usage = _new_usage()
+        results = _generate_multi_per_field(contractor_dict, MULTI_INSIGHT_FIELDS, usage, bypass_cache)
+        usage["baseline_prompt_tokens"] = usage["prompt_tokens"]
+        return results, usage
+
+    def on_result(item, result, error):
+        nonlocal calls_saved
+        c, contractor_dict, fingerprint = item
+        if error:
+            print(f"Multi-insight generation failed: {contractor_dict['name']}, Error: {error}")
+            return
+        insights, usage = result
+        for key in totals:
+            totals[key] += usage[key]
+        if usage["combined_calls"]:
+            # Only a combined call that came back parseable replaces the per-field calls
+            calls_saved += len(MULTI_INSIGHT_FIELDS) - usage["calls"]
+        c.business_summary = insights["business_summary"]
+        c.sales_tip = insights["sales_tip"]
+        c.risk_alert = insights["risk_alert"]
+        c.priority_suggestion = insights["priority_suggestion"]
+        c.next_action = insights["next_action"]
+        # Leave the fingerprint stale if any field failed, so the next run retries it
+        if not any(value.startswith("[Error generating") for value in insights.values()):
+            c.multi_insights_fingerprint = fingerprint
+        print(f"Multi-insights generated: {contractor_dict['name']}")
+
+    try:
+        stats = run_pool(
+            [(c, _contractor_dict(c), f"{MULTI_INSIGHT_PROMPT_VERSION}:{c.source_fingerprint}") for c in contractors],
+            work, on_result, on_batch=lambda: _commit_changes(session), concurrency=concurrency, batch_size=batch_size,
+        )
+    finally:
+        session.close()
+    stats.update(totals, mode=mode)
+    stats["calls_saved"] = calls_saved
+    stats["prompt_tokens_saved"] = totals["baseline_prompt_tokens"] - totals["prompt_tokens"]
+    print(f"Multi-insights ({mode}): {totals['calls']} calls, {stats['calls_saved']} calls saved, ~{stats['prompt_tokens_saved']} prompt tokens saved")
+    return stats
+
+NOMINATIM_DOMAIN = os.environ.get("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.environ.get("NOMINATIM_SCHEME", "https")
+GEOCODE_MIN_INTERVAL = 1.0  # Nominatim usage policy: at most one request per second
+GEOCODE_MISS_RETRY_DAYS = 30
+GEOCODE_COMMIT_EVERY = 50  # Nominatim lookups between commits of the geocode cache
+# Optional offline ZIP centroid table, e.g. the US Census ZCTA Gazetteer file (GEOID, INTPTLAT, INTPTLONG)
+# or any CSV with zip/latitude/longitude columns
+ZIP_CENTROIDS_PATH = os.environ.get("ZIP_CENTROIDS_PATH", "data/zip_centroids.csv")
+
+def _address_key(city, state, postal_code):
+    return ", ".join(" ".join(str(part).split()).upper() for part in (city, state, postal_code) if part)
+
+@functools.lru_cache(maxsize=None)
+def load_zip_centroids(path=ZIP_CENTROIDS_PATH):
+    """Load a ZIP -> (latitude, longitude) table; returns an empty table if the file is missing."""
+    if not os.path.exists(path):
+        return {}
+    centroids = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        dialect = csv.Sniffer().sniff(f.read(4096), delimiters=",\t")
+        f.seek(0)
+        reader = csv.DictReader(f, dialect=dialect)
+        columns = {name.strip().lower(): name for name in reader.fieldnames or []}
+
+        def column(*candidates):
+            name = next((columns[c] for c in candidates if c in columns), None)
+            if name is None:
+                raise ValueError(f"{path}: no {candidates[0]} column (expected one of {', '.join(candidates)}; "
+                                 f"found {', '.join(reader.fieldnames or []) or 'no header'})")
+            return name
+
+        zip_col = column("zip", "zipcode", "postal_code", "geoid")
+        lat_col = column("latitude", "lat", "intptlat")
+        lng_col = column("longitude", "lng", "lon", "intptlong")
+        for row in reader:
+            try:
+                centroids[row[zip_col].strip().zfill(5)] = (float(row[lat_col]), float(row[lng_col]))
+            except (TypeError, ValueError):
+                continue
+    logging.info(f"Loaded {len(centroids)} ZIP centroids from {path}")
+    return centroids
+
+@metrics.stage("geocode")
+def geocode_and_update_latlng(use_network=True, ids=None):
+    """Geocode contractors missing coordinates, one lookup per distinct address.
+
+    Addresses resolve from the geocode_cache table first, then the offline ZIP centroid table, and
+    only then from Nominatim (one request per second). Results are cached for later runs and applied
+    to every contractor sharing the address with one executemany UPDATE. ``ids`` limits the run to
+    those contractors, as do the ``ids`` arguments of the LLM jobs.
+    """
+    session = Session(expire_on_commit=False)
+    table = Contractor.__table__
+    query = (
+        select(table.c.id, table.c.city, table.c.state, table.c.postal_code)
+        .where((table.c.latitude == None) | (table.c.longitude == None))
+    )
+    if ids is not None:
+        query = query.where(table.c.id.in_(ids))
+    rows = session.execute(query).all()
+    ids_by_address = defaultdict(list)
+    parts_by_address = {}
+    for row in rows:
+        key = _address_key(row.city, row.state, row.postal_code)
+        if key:
+            ids_by_address[key].append(row.id)
+            parts_by_address.setdefault(key, row)
+    addresses = list(ids_by_address)
+    cached = {}
+    for offset in range(0, len(addresses), UPSERT_CHUNK_SIZE):
+        chunk = addresses[offset:offset + UPSERT_CHUNK_SIZE]
+        cached.update((entry.address, entry) for entry in session.query(GeocodeCache).filter(GeocodeCache.address.in_(chunk)))
+    stats = {"contractors": len(rows), "addresses": len(addresses), "cache": 0, "zip_centroid": 0, "nominatim": 0, "miss": 0}
+    retry_before = datetime.utcnow() - timedelta(days=GEOCODE_MISS_RETRY_DAYS)
+    centroids = load_zip_centroids()
+    geolocator = None
+    last_request = 0.0
+    lookups_since_commit = 0
+    resolved = {}
+    for key in addresses:
+        entry = cached.get(key)
+        if entry is not None and (entry.latitude is not None or not use_network or entry.updated_at >= retry_before):
+            if entry.latitude is not None:
+                resolved[key] = (entry.latitude, entry.longitude)
+                stats["cache"] += 1
             else:
-                print(f"Geocode failed: {c.name} ({address})")
-        except Exception as e:
-            print(f"Geocode error: {c.name} ({address}): {e}")
-        time.sleep(1)  # avoid rate limit
+                stats["miss"] += 1
+            continue
+        row = parts_by_address[key]
+        zip5 = (row.postal_code or "").strip()[:5]
+        if zip5 in centroids:
+            location, source = centroids[zip5], "zip_centroid"
+        elif use_network:
+            if geolocator is None:
+                geolocator = Nominatim(user_agent="gaf_sales_platform", domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+            time.sleep(max(0.0, last_request + GEOCODE_MIN_INTERVAL - time.monotonic()))  # avoid rate limit
+            last_request = time.monotonic()
+            address = f"{row.city or ''}, {row.state or ''}, {row.postal_code or ''}".strip(', ')
+            start = time.perf_counter()
+            try:
+                result = geolocator.geocode(address, timeout=10)
+            except Exception as e:
+                metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, target="nominatim", outcome=type(e).__name__)
+                metrics.HTTP_ERRORS.inc(target="nominatim")
+                print(f"Geocode error: {address}: {e}")
+                continue
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, target="nominatim", outcome="ok")
+            location, source = ((result.latitude, result.longitude), "nominatim") if result else (None, "miss")
+            lookups_since_commit += 1
+        else:
+            continue
+        stats[source] += 1
+        if entry is None:
+            entry = GeocodeCache(address=key)
+            session.add(entry)
+        entry.latitude, entry.longitude = location if location else (None, None)
+        entry.source = source
+        entry.updated_at = datetime.utcnow()
+        if location:
+            resolved[key] = location
+            print(f"Geocoded: {key} -> {location} ({source})")
+        else:
+            print(f"Geocode failed: {key}")
+        if lookups_since_commit >= GEOCODE_COMMIT_EVERY:
+            session.commit()  # keep paid-for lookups if the run is interrupted
+            lookups_since_commit = 0
+    updates = [
+        {"_id": contractor_id, "lat": lat, "lng": lng}
+        for key, (lat, lng) in resolved.items()
+        for contractor_id in ids_by_address[key]
+    ]
+    if updates:
+        session.execute(
+            table.update().where(table.c.id == bindparam("_id")).values(latitude=bindparam("lat"), longitude=bindparam("lng")),
+            updates,
+        )
+        bump_data_version(session)
     session.commit()
-    session.close() 
\ No newline at end of file
+    session.close()
+    stats["updated"] = len(updates)
+    logging.info(f"Geocoding: {stats}")
+    return stats
@@ -1,30 +1,127 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
+from sqlalchemy import select, update, bindparam, func, and_
+from models import Contractor, engine, bump_data_version, get_data_version
 
-DB_PATH = 'contractors.db'
+PAGE_SIZE = 20
+QUEUES = {
+    'Unreviewed, lowest AI score first': 'unreviewed',
+    'Lowest AI score first': 'low_score',
+    'Reviewed': 'reviewed',
+    'All': 'all',
+}
+# Only what the page renders; the long multi-insight columns are never loaded
+REVIEW_COLUMNS = [
+    Contractor.contractor_id, Contractor.name, Contractor.state, Contractor.insight,
+    Contractor.relevance_score, Contractor.actionability_score, Contractor.accuracy_score, Contractor.clarity_score,
+    Contractor.evaluation_comment, Contractor.manual_evaluation_comment,
+]
+TOTAL_SCORE = (
+    func.coalesce(Contractor.relevance_score, 0) + func.coalesce(Contractor.actionability_score, 0)
+    + func.coalesce(Contractor.accuracy_score, 0) + func.coalesce(Contractor.clarity_score, 0)
+)
 
-def get_contractors():
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query('SELECT * FROM contractors', conn)
-    conn.close()
-    return df
+def _queue_filter(query, queue, state):
+    reviewed = and_(Contractor.manual_evaluation_comment.isnot(None), Contractor.manual_evaluation_comment != '')
+    query = query.where(Contractor.insight.isnot(None), Contractor.insight != '')
+    if queue == 'unreviewed':
+        query = query.where(~reviewed)
+    elif queue == 'reviewed':
+        query = query.where(reviewed)
+    if queue in ('unreviewed', 'low_score'):
+        query = query.where(Contractor.relevance_score.isnot(None))
+    if state:
+        query = query.where(Contractor.state == state)
+    return query
+
+def _queue_order(queue):
+    if queue in ('unreviewed', 'low_score'):
+        return [TOTAL_SCORE.asc(), Contractor.id.asc()]
+    return [Contractor.id.asc()]
+
+# Cached reads are keyed by data_version, so a flush (which bumps it) invalidates them
+@st.cache_data(show_spinner=False)
+def load_page(queue, state, page, page_size, data_version):
+    query = _queue_filter(select(*REVIEW_COLUMNS), queue, state).order_by(*_queue_order(queue))
+    with engine.connect() as conn:
+        return pd.read_sql_query(query.offset(page * page_size).limit(page_size), conn)
+
+@st.cache_data(show_spinner=False)
+def count_queue(queue, state, data_version):
+    with engine.connect() as conn:
+        return conn.execute(_queue_filter(select(func.count()).select_from(Contractor), queue, state)).scalar()
+
+@st.cache_data(show_spinner=False)
+def list_states(data_version):
+    with engine.connect() as conn:
+        return [s for s in conn.execute(select(Contractor.state).distinct().order_by(Contractor.state)).scalars() if s]
+
+def current_data_version():
+    with engine.connect() as conn:
+        return get_data_version(conn)
+
+def save_manual_comments(comments):
+    """Write {contractor_id: comment} in one transaction with a single executemany UPDATE."""
+    if not comments:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(
+            update(Contractor.__table__)
+            .where(Contractor.__table__.c.contractor_id == bindparam('_contractor_id'))
+            .values(manual_evaluation_comment=bindparam('comment')),
+            [{'_contractor_id': cid, 'comment': comment} for cid, comment in comments.items()],
+        )
+        bump_data_version(conn)
+    return len(comments)
 
 def save_manual_comment(contractor_id, comment):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('UPDATE contractors SET manual_evaluation_comment = ? WHERE contractor_id = ?', (comment, contractor_id))
-    conn.commit()
-    conn.close()
+    save_manual_comments({contractor_id: comment})
+
+def _record_edit(contractor_id, original):
+    value = st.session_state[f'comment_{contractor_id}']
+    pending = st.session_state.pending_edits
+    if value == original:
+        pending.pop(contractor_id, None)
+    else:
+        pending[contractor_id] = value
+
+def _flush():
+    saved = save_manual_comments(st.session_state.pending_edits)
+    st.session_state.pending_edits = {}
+    st.session_state.flash = f'Saved {saved} comment(s).'
+
+def _discard():
+    for contractor_id in st.session_state.pending_edits:
+        st.session_state.pop(f'comment_{contractor_id}', None)
+    st.session_state.pending_edits = {}
 
 st.title('Contractor Insight Manual Evaluation')
-df = get_contractors()
-for idx, row in df.iterrows():
-    st.subheader(f"{row['name']} ({row['contractor_id']})")
-    st.write(f"**AI Insight:** {row['insight']}")
-    st.write(f"**AI Scores:** Relevance: {row['relevance_score']}, Actionability: {row['actionability_score']}, Accuracy: {row['accuracy_score']}, Clarity: {row['clarity_score']}")
-    st.write(f"**AI Comment:** {row['evaluation_comment']}")
-    manual_comment = st.text_area('Manual Evaluation Comment', value=row['manual_evaluation_comment'] or '', key=row['contractor_id'])
-    if st.button('Save', key='save_'+str(row['contractor_id'])):
-        save_manual_comment(row['contractor_id'], manual_comment)
-        st.success('Saved!') 
\ No newline at end of file
+st.session_state.setdefault('pending_edits', {})
+data_version = current_data_version()
+
+with st.sidebar:
+    queue = QUEUES[st.selectbox('Queue', list(QUEUES))]
+    state = st.selectbox('State', [''] + list_states(data_version), format_func=lambda s: s or 'All states')
+    total = count_queue(queue, state, data_version)
+    pages = max(1, -(-total // PAGE_SIZE))
+    page = st.number_input(f'Page (of {pages})', min_value=1, max_value=pages, value=1, step=1) - 1
+    pending = st.session_state.pending_edits
+    st.write(f'**{len(pending)}** unsaved edit(s)')
+    st.button(f'Save {len(pending)} edit(s)', on_click=_flush, disabled=not pending, type='primary')
+    st.button('Discard edits', on_click=_discard, disabled=not pending)
+
+if 'flash' in st.session_state:
+    st.success(st.session_state.pop('flash'))
+st.caption(f'{total} contractors in this queue')
+
+df = load_page(queue, state, page, PAGE_SIZE, data_version)
+for row in df.itertuples(index=False):
+    st.subheader(f"{row.name} ({row.contractor_id})")
+    st.write(f"**AI Insight:** {row.insight}")
+    st.write(f"**AI Scores:** Relevance: {row.relevance_score}, Actionability: {row.actionability_score}, Accuracy: {row.accuracy_score}, Clarity: {row.clarity_score}")
+    st.write(f"**AI Comment:** {row.evaluation_comment}")
+    original = '' if pd.isna(row.manual_evaluation_comment) else row.manual_evaluation_comment
+    key = f'comment_{row.contractor_id}'
+    if key not in st.session_state:
+        st.session_state[key] = st.session_state.pending_edits.get(row.contractor_id, original)
+    st.text_area('Manual Evaluation Comment', key=key, on_change=_record_edit, args=(row.contractor_id, original))
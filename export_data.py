@@ -1,16 +1,169 @@
-import pandas as pd
-import sqlite3
+import os
+import csv
+import gzip
+import json
+import hashlib
 import logging
+import argparse
+from datetime import datetime
+from sqlalchemy import select, func, Integer, Float, DateTime
+from models import Contractor, engine, get_meta, set_meta
 
 logging.basicConfig(filename='export.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 5000))
+FORMATS = ('csv', 'ndjson', 'parquet')
+PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+WATERMARK_KEY = 'export_watermark:{}:{}'  # absolute path, digest of columns and filters
+
+def _open_text(path, compression=None):
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class CsvSink:
+    def __init__(self, path, columns, compression=None):
+        self.file = _open_text(path, compression)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+class NdjsonSink:
+    """One JSON object per line, so the file can be streamed back without parsing it whole."""
+
+    def __init__(self, path, columns, compression=None):
+        self.file = _open_text(path, compression)
+        self.columns = columns
+
+    def write(self, rows):
+        self.file.writelines(
+            json.dumps({col: _json_value(value) for col, value in zip(self.columns, row)}, ensure_ascii=False) + '\n'
+            for row in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+class ParquetSink:
+    """Each chunk becomes a row group; the schema comes from the column types, not from the data."""
+
+    def __init__(self, path, columns, compression=PARQUET_COMPRESSION):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        self.pa = pa
+        self.columns = columns
+        types = {Integer: pa.int64(), Float: pa.float64(), DateTime: pa.timestamp('us')}
+        self.schema = pa.schema([
+            (col, next((t for sa_type, t in types.items() if isinstance(Contractor.__table__.c[col].type, sa_type)), pa.string()))
+            for col in columns
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression or PARQUET_COMPRESSION)
+
+    def write(self, rows):
+        data = {col: [row[i] for row in rows] for i, col in enumerate(self.columns)}
+        self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+SINKS = {'csv': CsvSink, 'ndjson': NdjsonSink, 'parquet': ParquetSink}
+
+def _filtered(query, state=None, city=None, min_rating=None, max_rating=None):
+    if state:
+        query = query.where(Contractor.state == state)
+    if city:
+        query = query.where(Contractor.city == city)
+    if min_rating is not None:
+        query = query.where(Contractor.rating >= min_rating)
+    if max_rating is not None:
+        query = query.where(Contractor.rating <= max_rating)
+    return query
+
+def export_contractors(path, fmt='csv', columns=None, filters=None, incremental=False, chunk_size=EXPORT_CHUNK_SIZE,
+                       compression=None):
+    """Stream contractors to ``path`` as CSV, NDJSON or Parquet, ``chunk_size`` rows at a time.
+
+    Rows come from a server-side cursor, so memory is bounded by one chunk regardless of table size.
+    ``.gz`` paths are gzipped (CSV/NDJSON); Parquet uses ``compression`` (default zstd). With
+    ``incremental`` only rows whose updated_at is at or after the watermark saved by the previous
+    incremental export to the same path with the same columns and filters are written (rows stamped
+    exactly at the watermark repeat).
+    The file is written next to ``path`` and renamed into place only once complete.
+    """
+    if fmt not in SINKS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    all_columns = [c.name for c in Contractor.__table__.columns]
+    columns = columns or all_columns
+    unknown = [c for c in columns if c not in all_columns]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    if fmt != 'parquet':
+        compression = 'gzip' if path.endswith('.gz') else None
+    query = _filtered(select(*[getattr(Contractor, col) for col in columns]), **(filters or {}))
+    # Per output file and selection, so exports to other paths or with other filters keep their own watermark
+    selection = json.dumps({"columns": columns, "filters": {k: v for k, v in (filters or {}).items() if v is not None}}, sort_keys=True)
+    watermark_key = WATERMARK_KEY.format(os.path.abspath(path), hashlib.sha1(selection.encode()).hexdigest()[:12])
+    tmp_path = f"{path}.tmp"
+    stats = {"path": path, "format": fmt, "rows": 0, "chunks": 0}
+    with engine.connect() as conn:
+        high = conn.execute(select(func.max(Contractor.updated_at))).scalar()
+        if incremental:
+            low = get_meta(conn, watermark_key)
+            if low:
+                query = query.where(Contractor.updated_at >= datetime.fromisoformat(low))
+            if high:
+                query = query.where(Contractor.updated_at <= high)
+            stats["since"] = low
+        sink = SINKS[fmt](tmp_path, columns, compression)
+        try:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query.order_by(Contractor.id))
+            for rows in result.partitions(chunk_size):
+                sink.write(rows)
+                stats["rows"] += len(rows)
+                stats["chunks"] += 1
+        finally:
+            sink.close()
+    os.replace(tmp_path, path)
+    if incremental and high:
+        with engine.begin() as conn:
+            set_meta(conn, watermark_key, high.isoformat())
+        stats["watermark"] = high.isoformat()
+    logging.info(f"Exported {stats['rows']} records to {path} ({fmt}, {stats['chunks']} chunks)")
+    return stats
+
 def export_all():
-    conn = sqlite3.connect('contractors.db')
-    df = pd.read_sql_query('SELECT * FROM contractors', conn)
-    df.to_csv('contractors_export.csv', index=False)
-    df.to_json('contractors_export.json', orient='records', force_ascii=False, indent=2)
-    logging.info(f"Exported {len(df)} records to contractors_export.csv and contractors_export.json")
-    conn.close()
+    export_contractors('contractors_export.csv', 'csv')
+    export_contractors('contractors_export.ndjson', 'ndjson')
+
+def main():
+    parser = argparse.ArgumentParser(description="Export contractors as CSV, NDJSON or Parquet in bounded-memory chunks.")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--output", help="Output path (default contractors_export.<format>; add .gz to gzip CSV/NDJSON)")
+    parser.add_argument("--columns", help="Comma-separated columns (default: all)")
+    parser.add_argument("--state")
+    parser.add_argument("--city")
+    parser.add_argument("--min-rating", type=float)
+    parser.add_argument("--max-rating", type=float)
+    parser.add_argument("--incremental", action="store_true", help="Only rows changed since the last incremental export to this path with the same columns and filters")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument("--compression", help="Parquet codec (zstd, snappy, gzip, none)")
+    args = parser.parse_args()
+    filters = {"state": args.state, "city": args.city, "min_rating": args.min_rating, "max_rating": args.max_rating}
+    columns = [c.strip() for c in args.columns.split(",") if c.strip()] if args.columns else None
+    stats = export_contractors(args.output or f"contractors_export.{args.format}", args.format, columns, filters,
+                               args.incremental, args.chunk_size, args.compression)
+    print(json.dumps(stats))
 
 if __name__ == "__main__":
-    export_all() 
\ No newline at end of file
+    main()
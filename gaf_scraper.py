@@ -1,13 +1,32 @@
 import requests
+import requests.adapters
 import json
+import os
 import time
+import random
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from apscheduler.schedulers.background import BackgroundScheduler
-from etl import clean_and_insert
+import threading
+import queue
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import metrics
+from etl import clean_and_insert, load_zip_centroids, geocode_and_update_latlng, update_insights, update_multi_insights
 
-# GAF Coveo API endpoint
-API_URL = "https://platform.cloud.coveo.com/rest/search/v2?organizationId=gafmaterialscorporationproduction3yalqk12"
+# GAF Coveo API endpoint (override with COVEO_API_URL, e.g. to point at a local mock server)
+API_URL = os.environ.get(
+    "COVEO_API_URL",
+    "https://platform.cloud.coveo.com/rest/search/v2?organizationId=gafmaterialscorporationproduction3yalqk12",
+)
+
+PAGE_SIZE = 100
+MAX_WORKERS = 4
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) seconds
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Coveo only serves results with firstResult + numberOfResults <= 5000 for a single query
+COVEO_MAX_RESULTS = 5000
 
 # Set up logging
 logging.basicConfig(
@@ -30,7 +49,42 @@ BODY_TEMPLATE = {
     "firstResult": 0,
 }
 
-def fetch_contractors(start=0, page_size=10, lat=None, lng=None, distance=25):
+class FetchError(Exception):
+    """A page could not be fetched after all retries."""
+
+class PipelineError(Exception):
+    """The writer or downstream stage of ``stream_collect`` failed; ``summary`` holds what was done."""
+
+    def __init__(self, message, summary):
+        super().__init__(message)
+        self.summary = summary
+
+_http_session = None
+_http_pool_size = 0
+_http_lock = threading.Lock()
+
+def get_http_session(pool_size=None):
+    """Shared keep-alive ``requests.Session``.
+
+    Callers that fan out pass their total number of concurrent requests as ``pool_size``; the
+    connection pool only ever grows, so every worker keeps its connection alive instead of urllib3
+    discarding the extras ("Connection pool is full").
+    """
+    global _http_session, _http_pool_size
+    with _http_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            _http_session.headers.update(HEADERS)
+        pool_size = max(pool_size or MAX_WORKERS, 10)
+        if pool_size > _http_pool_size:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            _http_session.mount("https://", adapter)
+            _http_session.mount("http://", adapter)
+            _http_pool_size = pool_size
+        return _http_session
+
+@metrics.stage("fetch")
+def fetch_contractors(start=0, page_size=10, lat=None, lng=None, distance=25, retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT):
     body = BODY_TEMPLATE.copy()
     body["firstResult"] = start
     body["numberOfResults"] = page_size
@@ -42,14 +96,33 @@ def fetch_contractors(start=0, page_size=10, lat=None, lng=None, distance=25):
                 "function": f"dist(@gaf_latitude, @gaf_longitude, {lat}, {lng})*0.000621371"
             }
         ]
-    try:
-        resp = requests.post(API_URL, headers=HEADERS, json=body)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        logging.error(f"Error fetching contractors for start={start}: {e}")
-        return {"results": []}
+    for attempt in range(retries + 1):
+        request_start = time.perf_counter()
+        outcome = None
+        try:
+            resp = get_http_session().post(API_URL, json=body, timeout=timeout)
+            outcome = str(resp.status_code)
+            if resp.status_code not in RETRY_STATUSES:
+                resp.raise_for_status()
+                return resp.json()
+            error = f"HTTP {resp.status_code}"
+        except requests.HTTPError as e:
+            metrics.HTTP_ERRORS.inc(target="coveo")
+            raise FetchError(f"start={start}: {e}") from e
+        except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+            outcome = outcome or type(e).__name__
+            error = str(e)
+        finally:
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - request_start, target="coveo", outcome=outcome or "error")
+        if attempt == retries:
+            metrics.HTTP_ERRORS.inc(target="coveo")
+            raise FetchError(f"start={start}: {error} after {retries + 1} attempts")
+        metrics.HTTP_RETRIES.inc(target="coveo")
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))  # full jitter
+        logging.warning(f"Fetch failed for start={start} ({error}), retry {attempt + 1}/{retries} in {delay:.1f}s")
+        time.sleep(delay)
 
+@metrics.stage("parse")
 def parse_results(data):
     contractors = []
     for item in data.get("results", []):
@@ -69,51 +142,317 @@ def parse_results(data):
         })
     return contractors
 
-def collect_data():
-    all_contractors = []
-    page_size = 10
-    lat, lng = 40.7217861, -74.0094471
-    distance = 25
-    total = 91  # For demo, fetch 20 records
-    starts = list(range(0, total, page_size))
-    logging.info("Starting concurrent data collection.")
-    with ThreadPoolExecutor(max_workers=4) as executor:
+def fetch_region(lat, lng, distance=25, page_size=PAGE_SIZE, max_workers=MAX_WORKERS, on_page=None, max_total=None):
+    """Fetch every page of one radius query.
+
+    The first page is fetched alone to read ``totalCount``; the remaining pages are fanned out over
+    ``max_workers`` threads. Parsed pages go to ``on_page(contractors)`` on the calling thread if
+    given, otherwise they are accumulated and returned. Pages that fail after all retries are
+    listed in ``failed_pages`` instead of being dropped silently. If ``totalCount`` exceeds
+    ``max_total`` only the first page is used and the result is flagged ``overflow``.
+    """
+    get_http_session(max_workers)
+    first = fetch_contractors(0, page_size, lat, lng, distance)
+    total = first.get("totalCount", 0)
+    if max_total is not None and total > max_total:
+        return {"total": total, "pages": 1, "contractors": parse_results(first), "failed_pages": [], "overflow": True}
+    if total > COVEO_MAX_RESULTS:
+        logging.warning(f"Query at ({lat}, {lng}) r={distance} matches {total} results; only the first {COVEO_MAX_RESULTS} are reachable")
+    reachable = min(total, COVEO_MAX_RESULTS)
+    result = {"total": total, "pages": 1, "contractors": [], "failed_pages": [], "overflow": False}
+    handle = on_page or result["contractors"].extend
+    handle(parse_results(first))
+    starts = list(range(page_size, reachable, page_size))
+    result["pages"] += len(starts)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_start = {
-            executor.submit(fetch_contractors, start, page_size, lat, lng, distance): start
+            executor.submit(fetch_contractors, start, min(page_size, reachable - start), lat, lng, distance): start
             for start in starts
         }
         for future in as_completed(future_to_start):
             start = future_to_start[future]
             try:
-                data = future.result()
-                contractors = parse_results(data)
-                all_contractors.extend(contractors)
+                contractors = parse_results(future.result())
+                handle(contractors)
                 logging.info(f"Fetched page starting at {start}, {len(contractors)} records.")
             except Exception as e:
+                result["failed_pages"].append(start)
                 logging.error(f"Error in page starting at {start}: {e}")
-    clean_and_insert(all_contractors)
+    result["failed_pages"].sort()
+    return result
+
+def collect_data(lat=40.7217861, lng=-74.0094471, distance=25, page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+    logging.info("Starting concurrent data collection.")
+    started = time.perf_counter()
+    region = fetch_region(lat, lng, distance, page_size, max_workers)
+    fetch_seconds = time.perf_counter() - started
+    all_contractors = region["contractors"]
+    if region["failed_pages"]:
+        logging.error(f"{len(region['failed_pages'])} of {region['pages']} pages failed (firstResult={region['failed_pages']})")
+    upsert = clean_and_insert(all_contractors)
     logging.info(f"Total {len(all_contractors)} records collected and inserted into the database.")
+    summary = {
+        "total": region["total"],
+        "pages": region["pages"],
+        "failed_pages": region["failed_pages"],
+        "collected": len(all_contractors),
+        "fetch_seconds": round(fetch_seconds, 3),
+        "pages_per_second": round(region["pages"] / fetch_seconds, 2) if fetch_seconds else None,
+        "upsert": upsert,
+    }
+    logging.info(f"Collection summary: pages={summary['pages']}, failed={len(summary['failed_pages'])}, "
+                 f"fetch={summary['fetch_seconds']}s ({summary['pages_per_second']} pages/s)")
+    return summary
+
+TILE_RADIUS_MILES = 25
+MIN_TILE_RADIUS_MILES = 2
+TILE_WORKERS = 4
+MILES_PER_DEGREE_LAT = 69.0
+
+# Approximate state bounding boxes (south, west, north, east); tiles cover their full extent and
+# results are then filtered on the contractor's state code
+STATE_BOUNDS = {
+    "AL": (30.14, -88.47, 35.01, -84.89), "AK": (51.20, -179.15, 71.39, -129.98), "AZ": (31.33, -114.82, 37.00, -109.04),
+    "AR": (33.00, -94.62, 36.50, -89.64), "CA": (32.53, -124.41, 42.01, -114.13), "CO": (36.99, -109.06, 41.00, -102.04),
+    "CT": (40.98, -73.73, 42.05, -71.79), "DE": (38.45, -75.79, 39.84, -75.05), "DC": (38.79, -77.12, 38.99, -76.91),
+    "FL": (24.52, -87.63, 31.00, -80.03), "GA": (30.36, -85.61, 35.00, -80.84), "HI": (18.91, -160.25, 22.24, -154.81),
+    "ID": (41.99, -117.24, 49.00, -111.04), "IL": (36.97, -91.51, 42.51, -87.50), "IN": (37.77, -88.10, 41.76, -84.78),
+    "IA": (40.38, -96.64, 43.50, -90.14), "KS": (36.99, -102.05, 40.00, -94.59), "KY": (36.50, -89.57, 39.15, -81.96),
+    "LA": (28.93, -94.04, 33.02, -88.82), "ME": (43.06, -71.08, 47.46, -66.95), "MD": (37.91, -79.49, 39.72, -75.05),
+    "MA": (41.24, -73.51, 42.89, -69.93), "MI": (41.70, -90.42, 48.31, -82.41), "MN": (43.50, -97.24, 49.38, -89.49),
+    "MS": (30.17, -91.66, 35.00, -88.10), "MO": (35.99, -95.77, 40.61, -89.10), "MT": (44.36, -116.05, 49.00, -104.04),
+    "NE": (40.00, -104.05, 43.00, -95.31), "NV": (35.00, -120.01, 42.00, -114.04), "NH": (42.70, -72.56, 45.31, -70.61),
+    "NJ": (38.93, -75.56, 41.36, -73.89), "NM": (31.33, -109.05, 37.00, -103.00), "NY": (40.50, -79.76, 45.02, -71.86),
+    "NC": (33.84, -84.32, 36.59, -75.46), "ND": (45.94, -104.05, 49.00, -96.55), "OH": (38.40, -84.82, 41.98, -80.52),
+    "OK": (33.62, -103.00, 37.00, -94.43), "OR": (41.99, -124.57, 46.29, -116.46), "PA": (39.72, -80.52, 42.27, -74.69),
+    "RI": (41.15, -71.91, 42.02, -71.12), "SC": (32.03, -83.35, 35.22, -78.54), "SD": (42.48, -104.06, 45.95, -96.44),
+    "TN": (34.98, -90.31, 36.68, -81.65), "TX": (25.84, -106.65, 36.50, -93.51), "UT": (37.00, -114.05, 42.00, -109.04),
+    "VT": (42.73, -73.44, 45.02, -71.46), "VA": (36.54, -83.68, 39.47, -75.24), "WA": (45.54, -124.85, 49.00, -116.92),
+    "WV": (37.20, -82.64, 40.64, -77.72), "WI": (42.49, -92.89, 47.08, -86.25), "WY": (40.99, -111.06, 45.01, -104.05),
+}
+
+def tile_bbox(south, west, north, east, radius=TILE_RADIUS_MILES, state=None):
+    """Cover a bounding box with overlapping radius queries.
+
+    Each tile owns a square cell of side ``radius * sqrt(2)`` (the square inscribed in its circle),
+    so adjacent circles overlap and the whole box is covered. Tiles are ``(lat, lng, radius, state)``.
+    """
+    side = radius * math.sqrt(2)
+    tiles = []
+    dlat = side / MILES_PER_DEGREE_LAT
+    lat = south + dlat / 2
+    while lat - dlat / 2 < north:
+        dlng = side / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        lng = west + dlng / 2
+        while lng - dlng / 2 < east:
+            tiles.append((round(lat, 5), round(lng, 5), radius, state))
+            lng += dlng
+        lat += dlat
+    return tiles
+
+def split_tile(tile):
+    """Four tiles of half the radius covering the parent's square cell."""
+    lat, lng, radius, state = tile
+    half = radius / 2
+    offset = half / math.sqrt(2)  # quarter of the cell side, in miles
+    dlat = offset / MILES_PER_DEGREE_LAT
+    dlng = offset / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return [(round(lat + sy * dlat, 5), round(lng + sx * dlng, 5), half, state) for sy in (-1, 1) for sx in (-1, 1)]
 
-def scheduled_job():
+def build_tiles(bbox=None, states=None, zips=None, radius=TILE_RADIUS_MILES):
+    tiles = []
+    if bbox:
+        tiles += tile_bbox(*bbox, radius=radius)
+    for state in states or []:
+        tiles += tile_bbox(*STATE_BOUNDS[state.upper()], radius=radius, state=state.upper())
+    if zips:
+        centroids = load_zip_centroids()
+        for zip_code in zips:
+            center = centroids.get(str(zip_code).zfill(5))
+            if center is None:
+                logging.warning(f"No centroid for ZIP {zip_code}; skipped (see ZIP_CENTROIDS_PATH)")
+                continue
+            tiles.append((center[0], center[1], radius, None))
+    return tiles
+
+def sweep_region(bbox=None, states=None, zips=None, radius=TILE_RADIUS_MILES, tile_workers=TILE_WORKERS,
+                 page_size=PAGE_SIZE, max_workers=MAX_WORKERS, max_tile_results=COVEO_MAX_RESULTS):
+    """Scrape a bounding box ``(south, west, north, east)``, a list of states and/or ZIP codes.
+
+    The region is tiled into overlapping radius queries that run ``tile_workers`` at a time. A tile
+    whose result count exceeds ``max_tile_results`` (the API's reachable window) is split into four
+    half-radius tiles, down to ``MIN_TILE_RADIUS_MILES``. Contractors are deduplicated by
+    ``contractor_id`` in memory before a single ``clean_and_insert``.
+    """
+    started = time.perf_counter()
+    get_http_session(tile_workers * max_workers)  # every tile fans out its pages on the shared session
+    tiles = build_tiles(bbox, states, zips, radius)
+    contractors = {}
+    summary = {"tiles": 0, "split_tiles": 0, "truncated_tiles": 0, "pages": 0, "failed_pages": 0, "fetched": 0, "failed_tiles": []}
+    with ThreadPoolExecutor(max_workers=tile_workers) as executor:
+        def submit(tile):
+            limit = max_tile_results if tile[2] / 2 >= MIN_TILE_RADIUS_MILES else None
+            return executor.submit(fetch_region, tile[0], tile[1], tile[2], page_size, max_workers, None, limit)
+
+        pending = {submit(tile): tile for tile in tiles}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = pending.pop(future)
+                summary["tiles"] += 1
+                try:
+                    region = future.result()
+                except Exception as e:
+                    summary["failed_tiles"].append(tile)
+                    logging.error(f"Tile {tile} failed: {e}")
+                    continue
+                if region["overflow"]:
+                    summary["split_tiles"] += 1
+                    logging.info(f"Tile {tile} has {region['total']} results; splitting")
+                    pending.update((submit(child), child) for child in split_tile(tile))
+                    continue
+                if region["total"] > COVEO_MAX_RESULTS:
+                    summary["truncated_tiles"] += 1
+                summary["pages"] += region["pages"]
+                summary["failed_pages"] += len(region["failed_pages"])
+                summary["fetched"] += len(region["contractors"])
+                for c in region["contractors"]:
+                    if c.get("contractor_id") and (tile[3] is None or c.get("state") == tile[3]):
+                        contractors[c["contractor_id"]] = c
+    summary["unique"] = len(contractors)
+    summary["fetch_seconds"] = round(time.perf_counter() - started, 3)
+    logging.info(f"Region sweep: {summary['tiles']} tiles ({summary['split_tiles']} split), "
+                 f"{summary['fetched']} fetched, {summary['unique']} unique contractors in {summary['fetch_seconds']}s")
+    summary["upsert"] = clean_and_insert(list(contractors.values()))
+    return summary
+
+PIPELINE_BATCH_SIZE = 500
+PIPELINE_QUEUE_PAGES = 16
+_DONE = object()
+
+def stream_collect(lat=40.7217861, lng=-74.0094471, distance=25, page_size=PAGE_SIZE, max_workers=MAX_WORKERS,
+                   batch_size=PIPELINE_BATCH_SIZE, queue_pages=PIPELINE_QUEUE_PAGES, geocode=False, insights=False):
+    """Pipelined ``collect_data``: fetch workers -> bounded page queue -> batch upsert writer.
+
+    Fetch workers block when ``queue_pages`` parsed pages are waiting, so memory is bounded by the
+    queue and one ``batch_size`` batch rather than the whole crawl. Each batch is committed as soon as
+    it fills, so rows become queryable while the crawl continues and a late crash keeps earlier
+    batches. With ``geocode``/``insights`` the ids of newly inserted contractors are handed to a
+    downstream stage that geocodes them and generates their insights.
+
+    Raises ``PipelineError`` once the threads are joined if a batch could not be written or a
+    downstream stage failed. Pages that fail after all retries are listed in ``failed_pages``.
+    """
+    started = time.perf_counter()
+    pages = queue.Queue(maxsize=queue_pages)
+    inserted = queue.Queue()
+    writer_failed = threading.Event()
+    summary = {"total": 0, "pages": 0, "failed_pages": [], "collected": 0, "batches": 0,
+               "inserted": 0, "updated": 0, "unchanged": 0, "time_to_first_row": None, "downstream_errors": []}
+
+    def write():
+        batch = []
+
+        def flush():
+            stats = clean_and_insert(batch)
+            batch.clear()
+            summary["batches"] += 1
+            for key in ("inserted", "updated", "unchanged"):
+                summary[key] += stats[key]
+            if summary["time_to_first_row"] is None:
+                summary["time_to_first_row"] = round(time.perf_counter() - started, 3)
+            if stats["inserted_ids"] and (geocode or insights):
+                inserted.put(stats["inserted_ids"])
+
+        while True:
+            page = pages.get()
+            if page is _DONE:
+                break
+            if writer_failed.is_set():
+                continue  # keep draining so fetch workers never block forever
+            try:
+                batch.extend(page)
+                summary["collected"] += len(page)
+                if len(batch) >= batch_size:
+                    flush()
+            except Exception as e:
+                writer_failed.set()
+                summary["error"] = str(e)
+                logging.error(f"Pipeline writer failed: {e}")
+        try:
+            if batch and not writer_failed.is_set():
+                flush()
+        except Exception as e:
+            writer_failed.set()
+            summary["error"] = str(e)
+            logging.error(f"Pipeline writer failed: {e}")
+        finally:
+            inserted.put(_DONE)
+
+    def downstream():
+        while True:
+            ids = inserted.get()
+            if ids is _DONE:
+                break
+            try:
+                if geocode:
+                    geocode_and_update_latlng(ids=ids)
+                if insights:
+                    update_insights(ids=ids)
+                    update_multi_insights(ids=ids)
+            except Exception as e:
+                summary["downstream_errors"].append(f"{len(ids)} contractors: {e}")
+                logging.error(f"Downstream stage failed for {len(ids)} contractors: {e}")
+
+    writer = threading.Thread(target=write, name="pipeline-writer")
+    follower = threading.Thread(target=downstream, name="pipeline-downstream")
+    writer.start()
+    follower.start()
+    get_http_session(max_workers)
     try:
-        logging.info("Scheduled data collection started.")
-        collect_data()
-        logging.info("Scheduled data collection finished.")
-    except Exception as e:
-        logging.error(f"Scheduled data collection failed: {e}")
+        first = fetch_contractors(0, page_size, lat, lng, distance)
+        summary["total"] = first.get("totalCount", 0)
+        pages.put(parse_results(first))
+        reachable = min(summary["total"], COVEO_MAX_RESULTS)
+        starts = queue.Queue()
+        for start in range(page_size, reachable, page_size):
+            starts.put(start)
+        summary["pages"] = 1 + starts.qsize()
+
+        def fetch_worker():
+            while not writer_failed.is_set():  # nothing more can be stored once the writer has failed
+                try:
+                    start = starts.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    pages.put(parse_results(fetch_contractors(start, min(page_size, reachable - start), lat, lng, distance)))
+                except FetchError as e:
+                    summary["failed_pages"].append(start)
+                    logging.error(f"Error in page starting at {start}: {e}")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for future in [executor.submit(fetch_worker) for _ in range(max_workers)]:
+                future.result()
+    finally:
+        pages.put(_DONE)
+        writer.join()
+        follower.join()
+    summary["failed_pages"].sort()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    logging.info(f"Pipelined collection: {summary}")
+    if "error" in summary:
+        raise PipelineError(f"Pipeline writer failed after {summary['batches']} batches: {summary['error']}", summary)
+    if summary["downstream_errors"]:
+        raise PipelineError(f"Downstream stage failed for {len(summary['downstream_errors'])} batches: "
+                            f"{summary['downstream_errors'][0]}", summary)
+    return summary
 
 def main():
     collect_data()
 
 if __name__ == "__main__":
-    # Manual run for demo
+    # Manual run, then hand over to the long-lived job daemon (weekly scrape -> ETL -> geocode -> insights -> evaluation)
     main()
-    # Set up weekly scheduler (runs every Monday at 2:00 AM)
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(scheduled_job, 'cron', day_of_week='mon', hour=2, minute=0)
-    scheduler.start()
-    print("Scheduler started. (For demo, will not block main thread.)")
-    try:
-        time.sleep(10)  # For demo, keep alive for 10 seconds
-    except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown() 
\ No newline at end of file
+    from jobs import run_daemon
+    run_daemon()
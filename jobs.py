@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import select
+from models import Contractor, JobRun, JobCheckpoint, Session
+from gaf_scraper import stream_collect, PipelineError
+from etl import geocode_and_update_latlng, update_insights, update_multi_insights, evaluate_insights
+import metrics
+
+# Weekly by default: Mondays at 2:00 AM (crontab syntax)
+JOB_SCHEDULE = os.environ.get("JOB_SCHEDULE", "0 2 * * mon")
+STAGE_BATCH_SIZE = int(os.environ.get("JOB_STAGE_BATCH_SIZE", 500))
+# An unfinished run is resumed at most this many times, and only while younger than this;
+# after that it is abandoned and the next tick starts a fresh run (and a fresh scrape)
+MAX_RESUME_ATTEMPTS = int(os.environ.get("JOB_MAX_RESUME_ATTEMPTS", 3))
+MAX_RESUME_AGE_HOURS = float(os.environ.get("JOB_MAX_RESUME_AGE_HOURS", 24))
+
+# Per-contractor stages run over contractors.id in ascending chunks; the checkpoint cursor is the
+# last id of the last committed chunk. Each job only does work for the rows in the chunk that need it.
+CHUNKED_STAGES = {
+    "geocode": lambda ids: geocode_and_update_latlng(ids=ids),
+    "insights": lambda ids: update_insights(ids=ids),
+    "multi_insights": lambda ids: update_multi_insights(ids=ids),
+    "evaluation": lambda ids: evaluate_insights(ids=ids),
+}
+STAGES = ["scrape", "geocode", "insights", "multi_insights", "evaluation"]
+
+def _checkpoint(session, run, stage):
+    checkpoint = session.query(JobCheckpoint).filter_by(run_id=run.id, stage=stage).first()
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(run_id=run.id, stage=stage, status="pending", cursor=0, processed=0)
+        session.add(checkpoint)
+        session.commit()
+    return checkpoint
+
+def _run_scrape(session, checkpoint, scrape_kwargs):
+    # The upsert is idempotent and commits per batch, so a resumed scrape simply runs again
+    summary = stream_collect(**scrape_kwargs)
+    if summary.get("error") or summary["failed_pages"]:
+        # A partial scrape must not let the later stages run; the checkpoint stays failed and is retried
+        raise PipelineError(summary.get("error") or f"{len(summary['failed_pages'])} of {summary['pages']} pages failed "
+                            f"(firstResult={summary['failed_pages']})", summary)
+    checkpoint.processed = summary["collected"]
+    checkpoint.stats = json.dumps(summary)
+    session.commit()
+
+def _run_chunked(session, checkpoint, job):
+    totals = {}
+    while True:
+        ids = session.execute(
+            select(Contractor.id).where(Contractor.id > checkpoint.cursor).order_by(Contractor.id).limit(STAGE_BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            break
+        stats = job(ids) or {}
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                totals[key] = totals.get(key, 0) + value
+        checkpoint.cursor = ids[-1]
+        checkpoint.processed += len(ids)
+        checkpoint.stats = json.dumps(totals)
+        session.commit()
+        logging.info(f"Stage {checkpoint.stage}: checkpoint at contractor id {checkpoint.cursor} ({checkpoint.processed} scanned)")
+
+def _write_summary(run_id, status, error, started, stages, since):
+    summary = {
+        "run_id": run_id,
+        "status": status,
+        "error": error,
+        "seconds": round(time.perf_counter() - started, 3),
+        "stages": stages,
+        # Stage timings, HTTP/LLM latencies, retries, errors, tokens and cost accrued during this run
+        "metrics": metrics.summary(since),
+    }
+    try:
+        metrics.write_run_summary(f"pipeline-run-{run_id}-{datetime.utcnow():%Y%m%dT%H%M%S}", summary)
+    except OSError as e:
+        logging.warning(f"Could not write the summary of pipeline run {run_id}: {e}")
+    return summary
+
+def _resumable_run(session):
+    """The latest unfinished run, unless it has used up its resume attempts or is too old (then it is abandoned)."""
+    run = session.query(JobRun).filter(JobRun.status.in_(("running", "failed"))).order_by(JobRun.id.desc()).first()
+    if run is None:
+        return None
+    age_hours = (datetime.utcnow() - run.started_at).total_seconds() / 3600 if run.started_at else 0
+    if (run.attempts or 1) > MAX_RESUME_ATTEMPTS or age_hours > MAX_RESUME_AGE_HOURS:
+        run.status, run.finished_at = "abandoned", datetime.utcnow()
+        session.commit()
+        logging.warning(f"Pipeline run {run.id} abandoned after {run.attempts or 1} attempts over {age_hours:.1f}h; starting a fresh run")
+        return None
+    return run
+
+def run_pipeline(resume=True, scrape_kwargs=None):
+    """Run scrape -> geocode -> insights -> multi-insights -> evaluation with a persistent checkpoint per stage.
+
+    With ``resume`` an unfinished run (crashed, killed or failed) is continued: completed stages are
+    skipped and chunked stages restart after their last committed contractor id. A run is resumed at
+    most ``MAX_RESUME_ATTEMPTS`` times and within ``MAX_RESUME_AGE_HOURS`` of its start; past that a
+    fresh run starts, so one persistent failure cannot block later scheduled scrapes. Every run, failed
+    or not, leaves a JSON summary (see metrics.write_run_summary) with per-stage timings and the
+    HTTP, LLM, token and cost metrics it accrued.
+    """
+    session = Session()
+    started, since = time.perf_counter(), metrics.summary()
+    run_id, status, error, stages = None, "failed", None, {}
+    try:
+        run = _resumable_run(session) if resume else None
+        if run is None:
+            run = JobRun(status="running")
+            session.add(run)
+            session.commit()
+            logging.info(f"Pipeline run {run.id} started")
+        else:
+            run.status, run.error, run.attempts = "running", None, (run.attempts or 1) + 1
+            session.commit()
+            logging.info(f"Pipeline run {run.id} resumed")
+        run_id = run.id
+        for stage in STAGES:
+            checkpoint = _checkpoint(session, run, stage)
+            if checkpoint.status == "completed":
+                stages[stage] = {"status": "skipped"}
+                continue
+            checkpoint.status = "running"
+            session.commit()
+            stage_start = time.perf_counter()
+            try:
+                if stage == "scrape":
+                    _run_scrape(session, checkpoint, scrape_kwargs or {})
+                else:
+                    _run_chunked(session, checkpoint, CHUNKED_STAGES[stage])
+            except Exception as e:
+                stages[stage] = {"status": "failed", "seconds": round(time.perf_counter() - stage_start, 3)}
+                error = f"{stage}: {e}"
+                session.rollback()
+                checkpoint.status = "failed"
+                run.status, run.error = "failed", error
+                session.commit()
+                logging.error(f"Pipeline run {run.id} failed in stage {stage}: {e}")
+                raise
+            checkpoint.status = "completed"
+            session.commit()
+            stages[stage] = {
+                "status": "completed",
+                "seconds": round(time.perf_counter() - stage_start, 3),
+                "processed": checkpoint.processed,
+                "stats": json.loads(checkpoint.stats) if checkpoint.stats else None,
+            }
+            logging.info(f"Stage {stage} completed")
+        run.status, run.finished_at = "completed", datetime.utcnow()
+        session.commit()
+        status = "completed"
+        logging.info(f"Pipeline run {run.id} completed")
+        return run.id
+    finally:
+        session.close()
+        if run_id is not None:
+            _write_summary(run_id, status, error, started, stages, since)
+
+def scheduled_pipeline():
+    try:
+        run_pipeline()
+    except Exception as e:
+        logging.error(f"Scheduled pipeline failed: {e}")
+
+def run_daemon(schedule=JOB_SCHEDULE):
+    """Long-lived scheduler: resume any unfinished run now, then run the pipeline on ``schedule``."""
+    session = Session()
+    unfinished = session.query(JobRun).filter(JobRun.status.in_(("running", "failed"))).count()
+    session.close()
+    if unfinished:
+        scheduled_pipeline()
+    scheduler = BlockingScheduler()
+    scheduler.add_job(scheduled_pipeline, CronTrigger.from_crontab(schedule), max_instances=1, coalesce=True)
+    logging.info(f"Job daemon started with schedule '{schedule}'")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        scheduler.shutdown()
+
+if __name__ == "__main__":
+    run_daemon()
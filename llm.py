@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import random
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import openai
+import metrics
+
+# Retries are handled here (with the shared rate limiter), not inside the OpenAI client.
+# Point OPENAI_BASE_URL at a local OpenAI-compatible stub server to run the jobs offline.
+openai.max_retries = 0
+
+MODEL = "gpt-3.5-turbo"
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 8))
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", 3500))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 90000))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 6))
+LLM_COMMIT_EVERY = int(os.environ.get("LLM_COMMIT_EVERY", 50))
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_MAX_AGE_DAYS = float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", 90))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 200000))
+LLM_CACHE_DISABLED = os.environ.get("LLM_CACHE_DISABLED") == "1"
+
+Completion = namedtuple("Completion", ["text", "prompt_tokens", "completion_tokens", "cached"], defaults=(False,))
+
+class ResponseCache:
+    """Content-addressed completion cache in a local SQLite file.
+
+    Entries are keyed by a hash of the request parameters, expire after ``max_age_days`` and are
+    evicted least-recently-used first once there are more than ``max_entries``.
+    """
+
+    EVICT_EVERY = 1000
+
+    def __init__(self, path=LLM_CACHE_PATH, max_age_days=LLM_CACHE_MAX_AGE_DAYS, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, prompt_tokens INTEGER, "
+                "completion_tokens INTEGER, created_at REAL, last_access REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+            self._evict()
+        return self.conn
+
+    @staticmethod
+    def key(model, prompt, temperature, max_tokens, **extra):
+        payload = json.dumps([model, prompt, temperature, max_tokens, extra], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.max_age_days * 86400),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return Completion(row[0], row[1], row[2], True)
+
+    def put(self, key, model, completion):
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, completion.text, completion.prompt_tokens, completion.completion_tokens, now, now),
+            )
+            self.writes += 1
+            if self.writes % self.EVICT_EVERY == 0:
+                self._evict()
+            conn.commit()
+
+    def _evict(self):
+        self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.max_age_days * 86400,))
+        self.conn.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+cache = ResponseCache()
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate_per_minute``."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait_seconds = (amount - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+class RateLimiter:
+    """Requests/min and tokens/min limits shared by every worker thread."""
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, estimated_tokens):
+        self.requests.acquire(1)
+        self.tokens.acquire(estimated_tokens)
+
+limiter = RateLimiter()
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English prompts
+    return len(text) // 4 + 1
+
+def _is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def _retry_delay(error, attempt):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def chat_completion(prompt, max_tokens=200, temperature=0.7, model=MODEL, bypass_cache=False, prompt_type="other", **kwargs):
+    """Single-prompt chat completion behind the response cache and the shared rate limiter, with exponential backoff on 429/5xx.
+
+    ``bypass_cache`` skips the lookup (for deliberate regeneration) but still stores the fresh response.
+    ``prompt_type`` labels the latency, retry, token and cost metrics; it is not part of the cache key.
+    """
+    cache_key = None
+    if not LLM_CACHE_DISABLED:
+        cache_key = ResponseCache.key(model, prompt, temperature, max_tokens, **kwargs)
+        if not bypass_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                metrics.LLM_CACHE_HITS.inc(prompt_type=prompt_type)
+                return cached
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        limiter.acquire(estimate_tokens(prompt) + max_tokens)
+        start = time.perf_counter()
+        try:
+            response = openai.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs,
+            )
+        except Exception as e:
+            outcome = str(getattr(e, "status_code", None) or type(e).__name__)
+            metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, prompt_type=prompt_type, model=model, outcome=outcome)
+            if attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                metrics.LLM_ERRORS.inc(prompt_type=prompt_type)
+                raise
+            metrics.LLM_RETRIES.inc(prompt_type=prompt_type, reason=outcome)
+            delay = _retry_delay(e, attempt)
+            logging.warning(f"OpenAI call failed ({e}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, prompt_type=prompt_type, model=model, outcome="ok")
+        usage = response.usage
+        completion = Completion(
+            response.choices[0].message.content.strip(),
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+        )
+        metrics.record_llm_usage(prompt_type, model, completion.prompt_tokens, completion.completion_tokens)
+        if cache_key is not None:
+            cache.put(cache_key, model, completion)
+        return completion
+
+def run_pool(items, work, on_result, on_batch=None, concurrency=LLM_CONCURRENCY, batch_size=LLM_COMMIT_EVERY):
+    """Run ``work(item)`` for every item on a thread pool.
+
+    ``on_result(item, result, error)`` and ``on_batch()`` are always called from the calling
+    thread, so they may safely touch a SQLAlchemy session; ``on_batch`` runs every
+    ``batch_size`` results and once at the end so progress is committed incrementally.
+    At most ``2 * concurrency`` items are in flight at a time.
+    """
+    stats = {"processed": 0, "failed": 0}
+    start = time.perf_counter()
+    hits, misses = cache.hits, cache.misses
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+
+        def submit(n):
+            for item in items:
+                pending[executor.submit(work, item)] = item
+                n -= 1
+                if n == 0:
+                    break
+
+        submit(2 * concurrency)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                    stats["failed"] += 1
+                on_result(item, result, error)
+                stats["processed"] += 1
+                if on_batch and stats["processed"] % batch_size == 0:
+                    on_batch()
+            submit(len(done))
+    if on_batch:
+        on_batch()
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["cache_hits"] = cache.hits - hits
+    stats["cache_misses"] = cache.misses - misses
+    return stats
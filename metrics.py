@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import bisect
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+# Seconds; covers per-row DB queries up to full pipeline stages
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+METRICS_SUMMARY_DIR = os.environ.get("METRICS_SUMMARY_DIR", "run_summaries")
+# USD per 1K (prompt, completion) tokens; override or extend with LLM_PRICES='{"model": [prompt, completion]}'
+LLM_PRICES = {"gpt-3.5-turbo": (0.0005, 0.0015)}
+LLM_PRICES.update({model: tuple(prices) for model, prices in json.loads(os.environ.get("LLM_PRICES", "{}")).items()})
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _summary_key(self, key):
+        return ",".join(f"{name}={value}" for name, value in zip(self.labelnames, key))
+
+class Counter(_Metric):
+    """Monotonic counter per label combination."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+    def snapshot(self):
+        with self.lock:
+            return {self._summary_key(key): value for key, value in self.values.items()}
+
+class Histogram(_Metric):
+    """Bucketed observations (Prometheus histogram: cumulative buckets, _sum and _count)."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, dict(series, buckets=list(series["buckets"]))) for key, series in self.values.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return {self._summary_key(key): {"count": series["count"], "sum": series["sum"]} for key, series in self.values.items()}
+
+def _register(metric):
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def summary(since=None):
+    """JSON-friendly totals per metric and label combination, or the increase since an earlier ``summary()``."""
+    with _registry_lock:
+        current = {name: metric.snapshot() for name, metric in _registry.items()}
+    if since is None:
+        return current
+    delta = {}
+    for name, series in current.items():
+        before = since.get(name, {})
+        for labels, value in series.items():
+            previous = before.get(labels)
+            if isinstance(value, dict):
+                previous = previous or {"count": 0, "sum": 0.0}
+                value = {"count": value["count"] - previous["count"], "sum": value["sum"] - previous["sum"]}
+                if not value["count"]:
+                    continue
+            else:
+                value -= previous or 0
+                if not value:
+                    continue
+            delta.setdefault(name, {})[labels] = value
+    return delta
+
+def write_run_summary(name, data, directory=METRICS_SUMMARY_DIR):
+    """Write a batch run summary to ``directory/<name>.json`` and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    logging.info(f"Run summary written to {path}")
+    return path
+
+STAGE_SECONDS = histogram("pipeline_stage_seconds", "Duration of one call of a pipeline stage", ["stage"])
+STAGE_ERRORS = counter("pipeline_stage_errors_total", "Pipeline stage calls that raised", ["stage"])
+HTTP_REQUEST_SECONDS = histogram("http_client_request_seconds", "Outgoing HTTP request latency per attempt", ["target", "outcome"])
+HTTP_RETRIES = counter("http_client_retries_total", "Outgoing HTTP requests retried", ["target"])
+HTTP_ERRORS = counter("http_client_errors_total", "Outgoing HTTP requests that failed for good", ["target"])
+LLM_REQUEST_SECONDS = histogram("llm_request_seconds", "OpenAI request latency per attempt", ["prompt_type", "model", "outcome"])
+LLM_RETRIES = counter("llm_retries_total", "OpenAI requests retried", ["prompt_type", "reason"])
+LLM_ERRORS = counter("llm_errors_total", "OpenAI completions that failed after retries", ["prompt_type"])
+LLM_CACHE_HITS = counter("llm_cache_hits_total", "Completions served from the response cache", ["prompt_type"])
+LLM_TOKENS = counter("llm_tokens_total", "Tokens sent and received", ["prompt_type", "model", "kind"])
+LLM_COST = counter("llm_cost_usd_total", "Estimated OpenAI spend from LLM_PRICES", ["prompt_type", "model"])
+API_REQUEST_SECONDS = histogram("api_request_seconds", "API request latency until the response starts", ["endpoint", "method", "status"])
+API_DB_QUERY_SECONDS = histogram("api_db_query_seconds", "Database statement latency per API endpoint", ["endpoint"])
+
+def stage(name):
+    """Decorator recording each call's duration (and failures) under ``pipeline_stage_seconds{stage=name}``."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.inc(stage=name)
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+        return wrapper
+    return decorator
+
+def record_llm_usage(prompt_type, model, prompt_tokens, completion_tokens):
+    LLM_TOKENS.inc(prompt_tokens, prompt_type=prompt_type, model=model, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, prompt_type=prompt_type, model=model, kind="completion")
+    prices = LLM_PRICES.get(model)
+    if prices:
+        LLM_COST.inc((prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000, prompt_type=prompt_type, model=model)
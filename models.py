@@ -1,4 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, Text, create_engine, UniqueConstraint, DateTime, func
+import os
+import re
+import json
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, Text, create_engine, UniqueConstraint, DateTime, func, inspect, text, Index, Table, ForeignKey, select, event, bindparam
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -32,8 +41,330 @@ class Contractor(Base):
     next_action = Column(Text)  # AI-generated: recommended next action
     latitude = Column(Float)  # Geocoded latitude
     longitude = Column(Float)  # Geocoded longitude
+    source_fingerprint = Column(String, index=True)  # Hash of the scraped fields that feed the prompts
+    insight_fingerprint = Column(String)  # Prompt version + source fingerprint that produced `insight`
+    multi_insights_fingerprint = Column(String)  # Prompt version + source fingerprint that produced the five multi-insights
+    evaluation_fingerprint = Column(String)  # Prompt version + insight fingerprint that produced the evaluation scores
+    # Last write (incremental export watermark). Set in Python, not with CURRENT_TIMESTAMP, so every value has
+    # the same stored format and compares correctly against bound datetimes (keyset cursors, watermarks)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Derived by update_lead_scores() whenever the fields they depend on change; see PRIORITY_LEVELS
+    priority_level = Column(Integer)  # Parsed from priority_suggestion: 3 high, 2 medium, 1 low, 0 unknown
+    lead_score = Column(Float)  # 0-100 ranking score, see LEAD_SCORE_WEIGHTS
+
+    __table_args__ = (
+        Index('ix_contractors_lat_lng', 'latitude', 'longitude'),  # Bounding-box fallback when R*Tree is unavailable
+        Index('ix_contractors_state_city', 'state', 'city'),  # API filters: state, state + city
+        Index('ix_contractors_rating', 'rating'),  # min/max_rating filters and order_by=rating
+        Index('ix_contractors_reviews', 'reviews'),  # order_by=reviews
+        Index('ix_contractors_lead_score', 'lead_score'),  # order_by=lead_score, min_score filter
+        Index('ix_contractors_priority_level', 'priority_level', 'lead_score'),  # Top leads within a priority level
+    )
+
+# SQLite R*Tree over contractor coordinates, kept in sync with the contractors table by triggers
+SPATIAL_INDEX_TABLE = 'contractor_rtree'
+SPATIAL_INDEX_DDL = [
+    f"CREATE VIRTUAL TABLE {SPATIAL_INDEX_TABLE} USING rtree(id, min_lat, max_lat, min_lng, max_lng)",
+    f"""CREATE TRIGGER IF NOT EXISTS contractors_rtree_insert AFTER INSERT ON contractors
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL BEGIN
+        INSERT OR REPLACE INTO {SPATIAL_INDEX_TABLE} VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS contractors_rtree_update AFTER UPDATE OF latitude, longitude ON contractors BEGIN
+        DELETE FROM {SPATIAL_INDEX_TABLE} WHERE id = OLD.id;
+        INSERT INTO {SPATIAL_INDEX_TABLE}
+        SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS contractors_rtree_delete AFTER DELETE ON contractors BEGIN
+        DELETE FROM {SPATIAL_INDEX_TABLE} WHERE id = OLD.id;
+    END""",
+    f"""INSERT INTO {SPATIAL_INDEX_TABLE}
+        SELECT id, latitude, latitude, longitude, longitude FROM contractors
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL""",
+]
+
+def has_spatial_index(engine):
+    return engine.dialect.name == 'sqlite' and inspect(engine).has_table(SPATIAL_INDEX_TABLE)
+
+class Certification(Base):
+    __tablename__ = 'certifications'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+# Contractor <-> certification links, normalized from Contractor.certifications by the ETL
+contractor_certifications = Table(
+    'contractor_certifications', Base.metadata,
+    Column('contractor_id', Integer, ForeignKey('contractors.id', ondelete='CASCADE'), primary_key=True),
+    Column('certification_id', Integer, ForeignKey('certifications.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_contractor_certifications_certification_id', 'certification_id', 'contractor_id'),
+)
+
+def parse_certifications(value):
+    """Certification names from the JSON text stored in Contractor.certifications."""
+    try:
+        data = json.loads(value) if value else []
+    except ValueError:
+        data = [value]
+    if not isinstance(data, list):
+        data = [data]
+    return sorted({str(name).strip() for name in data if name is not None and str(name).strip()})
+
+def sync_certifications(conn, certifications_by_id, chunk_size=500):
+    """Replace the certification links of the given contractors; ``certifications_by_id`` maps contractors.id to names."""
+    if not certifications_by_id:
+        return
+    cert_table = Certification.__table__
+    names = sorted({name for values in certifications_by_id.values() for name in values})
+    ids = {}
+    for offset in range(0, len(names), chunk_size):
+        ids.update(conn.execute(select(cert_table.c.name, cert_table.c.id).where(cert_table.c.name.in_(names[offset:offset + chunk_size]))).all())
+    missing = [name for name in names if name not in ids]
+    if missing:
+        conn.execute(cert_table.insert(), [{"name": name} for name in missing])
+        for offset in range(0, len(missing), chunk_size):
+            ids.update(conn.execute(select(cert_table.c.name, cert_table.c.id).where(cert_table.c.name.in_(missing[offset:offset + chunk_size]))).all())
+    contractor_ids = list(certifications_by_id)
+    for offset in range(0, len(contractor_ids), chunk_size):
+        conn.execute(contractor_certifications.delete().where(
+            contractor_certifications.c.contractor_id.in_(contractor_ids[offset:offset + chunk_size])
+        ))
+    links = [
+        {"contractor_id": contractor_id, "certification_id": ids[name]}
+        for contractor_id, values in certifications_by_id.items()
+        for name in values
+    ]
+    if links:
+        conn.execute(contractor_certifications.insert(), links)
+
+PRIORITY_LEVELS = {'high': 3, 'medium': 2, 'low': 1, 'unknown': 0}
+# Points each normalized (0..1) component contributes to the 0-100 lead score
+LEAD_SCORE_WEIGHTS = {'priority': 40, 'rating': 20, 'reviews': 20, 'certifications': 10, 'evaluation': 10}
+# Not yet suggested ranks between low and medium, so a missing LLM answer neither buries nor promotes a lead
+PRIORITY_LEVEL_WEIGHTS = {3: 1.0, 2: 0.6, 1: 0.2, 0: 0.4}
+LEAD_SCORE_REVIEWS_CAP = 1000  # Review counts are log-scaled and saturate here
+LEAD_SCORE_CERTIFICATIONS_CAP = 3
+EVALUATION_SCORE_FIELDS = ['relevance_score', 'actionability_score', 'accuracy_score', 'clarity_score']
+LEAD_SCORE_CHUNK_SIZE = 1000
+
+def parse_priority_levels(suggestions):
+    """priority_level for a Series of priority_suggestion texts: the first High/Medium/Low word, else 0."""
+    words = suggestions.fillna('').astype(str).str.extract(r'\b(high|medium|low)\b', flags=re.IGNORECASE)[0]
+    return words.str.lower().map(PRIORITY_LEVELS).fillna(0).astype(int)
+
+def compute_lead_scores(df):
+    """0-100 lead score per row of ``df`` (priority_level, rating, reviews, certification_count and the evaluation scores)."""
+    w = LEAD_SCORE_WEIGHTS
+    priority = df['priority_level'].map(PRIORITY_LEVEL_WEIGHTS)
+    rating = (pd.to_numeric(df['rating'], errors='coerce').fillna(0) / 5).clip(0, 1)
+    reviews = pd.to_numeric(df['reviews'], errors='coerce').fillna(0).clip(lower=0)
+    reviews = (np.log1p(reviews) / np.log1p(LEAD_SCORE_REVIEWS_CAP)).clip(0, 1)
+    certifications = (df['certification_count'] / LEAD_SCORE_CERTIFICATIONS_CAP).clip(0, 1)
+    # Scores are 1-5; contractors not evaluated yet get the midpoint
+    evaluation = (df[EVALUATION_SCORE_FIELDS].apply(pd.to_numeric, errors='coerce').mean(axis=1) / 5).fillna(0.5).clip(0, 1)
+    score = (w['priority'] * priority + w['rating'] * rating + w['reviews'] * reviews
+             + w['certifications'] * certifications + w['evaluation'] * evaluation)
+    return score.round(2)
+
+def update_lead_scores(conn, ids=None, chunk_size=LEAD_SCORE_CHUNK_SIZE):
+    """Recompute priority_level and lead_score for contractors ``ids`` (all if None) inside the caller's transaction.
+
+    Rows are read and written ``chunk_size`` at a time, scored column-wise, and written back with one
+    executemany UPDATE per chunk. Returns the number of contractors scored.
+    """
+    table = Contractor.__table__
+    certification_count = (
+        select(func.count()).where(contractor_certifications.c.contractor_id == table.c.id).scalar_subquery()
+    )
+    columns = [table.c.id, table.c.priority_suggestion, table.c.rating, table.c.reviews,
+               *[table.c[f] for f in EVALUATION_SCORE_FIELDS], certification_count.label('certification_count')]
+    update_stmt = table.update().where(table.c.id == bindparam('_id')).values(
+        priority_level=bindparam('level'), lead_score=bindparam('score')
+    )
+    if ids is None:
+        ids = conn.execute(select(table.c.id)).scalars().all()
+    ids = sorted(set(ids))
+    scored = 0
+    for offset in range(0, len(ids), chunk_size):
+        result = conn.execute(select(*columns).where(table.c.id.in_(ids[offset:offset + chunk_size])))
+        df = pd.DataFrame(result.all(), columns=list(result.keys()))
+        if df.empty:
+            continue
+        df['priority_level'] = parse_priority_levels(df['priority_suggestion'])
+        df['lead_score'] = compute_lead_scores(df)
+        conn.execute(update_stmt, [
+            {'_id': i, 'level': level, 'score': score}
+            for i, level, score in zip(df['id'].tolist(), df['priority_level'].tolist(), df['lead_score'].tolist())
+        ])
+        scored += len(df)
+    return scored
+
+class GeocodeCache(Base):
+    __tablename__ = 'geocode_cache'
+    address = Column(String, primary_key=True)  # Normalized "city, state, postal_code"
+    latitude = Column(Float)  # NULL when the address could not be geocoded
+    longitude = Column(Float)
+    source = Column(String)  # zip_centroid, nominatim or miss
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class JobRun(Base):
+    __tablename__ = 'job_runs'
+    id = Column(Integer, primary_key=True)
+    status = Column(String, default='running')  # running, failed, completed or abandoned
+    started_at = Column(DateTime, default=func.now())
+    finished_at = Column(DateTime)
+    error = Column(Text)
+    attempts = Column(Integer, default=1)  # 1 + number of times the run was resumed
+
+class JobCheckpoint(Base):
+    __tablename__ = 'job_checkpoints'
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey('job_runs.id', ondelete='CASCADE'), nullable=False)
+    stage = Column(String, nullable=False)
+    status = Column(String, default='pending')  # pending, running, failed or completed
+    cursor = Column(Integer, default=0)  # Last contractors.id fully processed by this stage
+    processed = Column(Integer, default=0)
+    stats = Column(Text)  # JSON summary of the stage
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (UniqueConstraint('run_id', 'stage'),)
+
+class AppMeta(Base):
+    __tablename__ = 'app_meta'
+    key = Column(String, primary_key=True)
+    value = Column(String)
+
+# Incremented in the same transaction as every commit that changes contractor data, so readers
+# (the API response cache) can tell whether anything they cached is stale
+DATA_VERSION_KEY = 'data_version'
+
+def get_meta(conn, key, default=None):
+    value = conn.execute(select(AppMeta.value).where(AppMeta.key == key)).scalar()
+    return value if value is not None else default
+
+def set_meta(conn, key, value):
+    if conn.execute(AppMeta.__table__.update().where(AppMeta.key == key).values(value=value)).rowcount == 0:
+        conn.execute(AppMeta.__table__.insert().values(key=key, value=value))
+
+def get_data_version(conn):
+    return int(get_meta(conn, DATA_VERSION_KEY, 0))
+
+def bump_data_version(conn):
+    """Increment the data version inside the caller's transaction (a Connection or Session)."""
+    updated = conn.execute(
+        text("UPDATE app_meta SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT) WHERE key = :key"),
+        {'key': DATA_VERSION_KEY},
+    )
+    if updated.rowcount == 0:
+        conn.execute(AppMeta.__table__.insert().values(key=DATA_VERSION_KEY, value='1'))
+
+# Bump whenever migrate() gains a step; SQLite stores the applied version in PRAGMA user_version
+SCHEMA_VERSION = 5
+
+def migrate(engine):
+    """Upgrade an existing database in place.
+
+    Adds columns and indexes that create_all() does not add to existing tables, and builds the
+    derived certification links, lead scores and spatial index from existing rows. SQLite databases already at
+    SCHEMA_VERSION are skipped, so startup does not re-inspect the schema every time.
+    """
+    sqlite = engine.dialect.name == 'sqlite'
+    if sqlite:
+        with engine.connect() as conn:
+            if conn.execute(text("PRAGMA user_version")).scalar() >= SCHEMA_VERSION:
+                return
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        # Populate certification links for databases created before they existed
+        if conn.execute(select(contractor_certifications.c.contractor_id).limit(1)).first() is None:
+            rows = conn.execute(text(
+                "SELECT id, certifications FROM contractors WHERE certifications IS NOT NULL AND certifications NOT IN ('', '[]')"
+            )).all()
+            sync_certifications(conn, {row.id: parse_certifications(row.certifications) for row in rows})
+        if sqlite and not inspector.has_table(SPATIAL_INDEX_TABLE):
+            try:
+                for statement in SPATIAL_INDEX_DDL:
+                    conn.execute(text(statement))
+            except OperationalError as e:
+                # SQLite built without the R*Tree module: nearby queries fall back to ix_contractors_lat_lng
+                logging.warning(f"Spatial index unavailable: {e}")
+        # Rows written before updated_at existed count as written now
+        conn.execute(
+            text("UPDATE contractors SET updated_at = :now WHERE updated_at IS NULL").bindparams(bindparam('now', type_=DateTime)),
+            {'now': datetime.utcnow()},
+        )
+        unscored = conn.execute(select(Contractor.id).where(Contractor.lead_score.is_(None))).scalars().all()
+        if unscored:
+            update_lead_scores(conn, unscored)
+        if get_data_version(conn) == 0:
+            bump_data_version(conn)
+        if sqlite:
+            # Refresh planner statistics so the new indexes are actually chosen
+            conn.execute(text("ANALYZE"))
+            conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    logging.info(f"Database schema migrated to version {SCHEMA_VERSION}")
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///contractors.db")
+# Async (API_ASYNC_DB=1) counterpart of DATABASE_URL; SQLite needs the aiosqlite driver installed
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 30000))
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
+def create_db_engine(url=DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    """Engine shared by the API, ETL, jobs and tools.
+
+    File-backed SQLite gets a real connection pool and, on every new connection, WAL journaling
+    (readers no longer block the writer), a busy timeout instead of immediate "database is locked"
+    errors, and synchronous=NORMAL, which is durable under WAL except for power loss.
+    """
+    if not url.startswith('sqlite'):
+        return create_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True)
+    if url in ('sqlite://', 'sqlite:///:memory:'):
+        # Every pooled connection would get its own empty in-memory database
+        return create_engine(url)
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+    event.listen(engine, 'connect', _sqlite_pragmas)
+    return engine
+
+def create_async_db_engine(url=ASYNC_DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    """asyncio engine for the API (SQLAlchemy asyncio + aiosqlite), tuned like create_db_engine().
+
+    The schema is still created and migrated through the sync ``engine`` at import time.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    if not url.startswith('sqlite'):
+        return create_async_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True)
+    async_engine = create_async_engine(
+        url, pool_size=pool_size, max_overflow=max_overflow, connect_args={'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    )
+    event.listen(async_engine.sync_engine, 'connect', _sqlite_pragmas)
+    return async_engine
 
 # 初始化数据库
-engine = create_engine('sqlite:///contractors.db')
+engine = create_db_engine()
 Base.metadata.create_all(engine)
+migrate(engine)
 Session = sessionmaker(bind=engine) 
\ No newline at end of file
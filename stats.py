@@ -0,0 +1,111 @@
+import threading
+from sqlalchemy import select, func, case, cast, and_, Integer
+from models import Contractor, engine, get_data_version
+
+SCORE_FIELDS = ['relevance_score', 'actionability_score', 'accuracy_score', 'clarity_score']
+# Lower edges of the review-count buckets; the last bucket is open-ended
+REVIEW_BUCKETS = [0, 1, 10, 25, 50, 100, 250, 500, 1000]
+RATING_BUCKET_WIDTH = 0.5
+STATS_TOP_N = 50
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+def _grouped_counts(conn, *columns, where=None, limit=None):
+    query = select(*columns, func.count().label('count')).group_by(*columns).order_by(func.count().desc(), *columns)
+    if where is not None:
+        query = query.where(where)
+    if limit:
+        query = query.limit(limit)
+    return conn.execute(query).all()
+
+def _review_bucket():
+    whens = [(Contractor.reviews >= low, low) for low in reversed(REVIEW_BUCKETS)]
+    return case(*whens, else_=None)
+
+def _has_text(column):
+    return and_(column.isnot(None), column != '')
+
+def _coverage(conn):
+    c = Contractor
+    counts = conn.execute(select(
+        func.count().label('total'),
+        func.count(case((_has_text(c.insight), 1))).label('insight'),
+        func.count(case((_has_text(c.business_summary), 1))).label('multi_insights'),
+        func.count(case((c.relevance_score.isnot(None), 1))).label('evaluated'),
+        func.count(case((_has_text(c.manual_evaluation_comment), 1))).label('manual_evaluation'),
+        func.count(case((and_(c.latitude.isnot(None), c.longitude.isnot(None)), 1))).label('geocoded'),
+    )).one()._asdict()
+    total = counts['total']
+    coverage = {name: {'count': value, 'percent': round(100.0 * value / total, 2) if total else 0.0}
+                for name, value in counts.items() if name != 'total'}
+    return total, coverage
+
+def _score_summary(conn, field):
+    column = getattr(Contractor, field)
+    histogram = {int(row[0]): row.count for row in _grouped_counts(conn, column, where=column.isnot(None))}
+    summary = conn.execute(select(func.count(column), func.avg(column), func.min(column), func.max(column))).one()
+    return {
+        'histogram': dict(sorted(histogram.items())),
+        'count': summary[0],
+        'mean': round(summary[1], 3) if summary[1] is not None else None,
+        'min': summary[2],
+        'max': summary[3],
+    }
+
+def _compute(conn, top_n):
+    c = Contractor
+    total, coverage = _coverage(conn)
+    # CAST truncates, which is floor() for non-negative ratings and portable to SQLite builds without math functions
+    rating_bucket = (cast(c.rating / RATING_BUCKET_WIDTH, Integer) * RATING_BUCKET_WIDTH).label('bucket')
+    rating_summary = conn.execute(select(func.count(c.rating), func.avg(c.rating), func.min(c.rating), func.max(c.rating))).one()
+    reviews_summary = conn.execute(select(func.count(c.reviews), func.avg(c.reviews), func.sum(c.reviews), func.max(c.reviews))).one()
+    return {
+        'total': total,
+        'coverage': coverage,
+        'by_state': [{'state': row.state, 'count': row.count} for row in _grouped_counts(conn, c.state, limit=top_n)],
+        'by_city': [{'state': row.state, 'city': row.city, 'count': row.count}
+                    for row in _grouped_counts(conn, c.state, c.city, limit=top_n)],
+        'by_type': [{'type': row.type, 'count': row.count} for row in _grouped_counts(conn, c.type, limit=top_n)],
+        'rating': {
+            'count': rating_summary[0],
+            'mean': round(rating_summary[1], 3) if rating_summary[1] is not None else None,
+            'min': rating_summary[2],
+            'max': rating_summary[3],
+            'histogram': [{'min': float(row.bucket), 'max': float(row.bucket) + RATING_BUCKET_WIDTH, 'count': row.count}
+                          for row in sorted(_grouped_counts(conn, rating_bucket, where=c.rating.isnot(None)), key=lambda r: r.bucket)],
+        },
+        'reviews': {
+            'count': reviews_summary[0],
+            'mean': round(reviews_summary[1], 2) if reviews_summary[1] is not None else None,
+            'total': reviews_summary[2],
+            'max': reviews_summary[3],
+            'histogram': [
+                {'min': row.bucket, 'max': next((edge for edge in REVIEW_BUCKETS if edge > row.bucket), None), 'count': row.count}
+                for row in sorted(_grouped_counts(conn, _review_bucket().label('bucket'), where=c.reviews.isnot(None)),
+                                  key=lambda r: r.bucket)
+            ],
+        },
+        'scores': {field: _score_summary(conn, field) for field in SCORE_FIELDS},
+    }
+
+def compute_stats(top_n=STATS_TOP_N, bind=None):
+    """Aggregate contractor statistics computed with GROUP BY queries, never loading full rows.
+
+    Covers counts by state, city and type (top ``top_n`` each), rating and review histograms,
+    per-dimension evaluation score histograms and insight/geocode coverage. Results are memoized
+    per data version, so repeated calls are free until the ETL or a job commits new data.
+    """
+    bind = bind or engine
+    with bind.connect() as conn:
+        version = get_data_version(conn)
+        key = (str(bind.url), top_n)
+        with _memo_lock:
+            cached = _memo.get(key)
+        if cached is not None and cached['data_version'] == version:
+            return cached
+        stats = _compute(conn, top_n)
+    stats['data_version'] = version
+    with _memo_lock:
+        _memo[key] = stats
+    return stats
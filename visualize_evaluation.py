@@ -1,29 +1,59 @@
-import pandas as pd
-import sqlite3
 import matplotlib.pyplot as plt
 import logging
+from stats import compute_stats, SCORE_FIELDS
 
 logging.basicConfig(filename='visualize.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
+def _value_at(values, counts, rank):
+    seen = 0
+    for value, count in zip(values, counts):
+        seen += count
+        if seen > rank:
+            return value
+    return values[-1]
+
+def _quantile(values, counts, q):
+    # Linear interpolation between order statistics, as matplotlib's boxplot_stats does on raw data
+    position = q * (sum(counts) - 1)
+    lower = int(position)
+    low, high = _value_at(values, counts, lower), _value_at(values, counts, lower + 1)
+    return low + (high - low) * (position - lower)
+
+def box_stats(histogram, label):
+    """matplotlib bxp() statistics from a {score: count} histogram instead of the raw column."""
+    values = sorted(histogram)
+    counts = [histogram[v] for v in values]
+    q1, med, q3 = (_quantile(values, counts, q) for q in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    inside = [v for v in values if q1 - 1.5 * iqr <= v <= q3 + 1.5 * iqr]
+    return {
+        'label': label,
+        'q1': q1, 'med': med, 'q3': q3,
+        'mean': sum(v * c for v, c in zip(values, counts)) / sum(counts),
+        'whislo': inside[0], 'whishi': inside[-1],
+        'fliers': [v for v in values if v not in inside],
+    }
+
 def visualize_scores():
-    conn = sqlite3.connect('contractors.db')
-    df = pd.read_sql_query('SELECT * FROM contractors', conn)
-    conn.close()
-    scores = ['relevance_score', 'actionability_score', 'accuracy_score', 'clarity_score']
-    for score in scores:
+    stats = compute_stats()
+    for score in SCORE_FIELDS:
+        histogram = stats['scores'][score]['histogram']
+        if not histogram:
+            logging.info(f'No {score} values to plot.')
+            continue
         plt.figure(figsize=(8, 4))
-        df[score].dropna().astype(int).hist(bins=5, edgecolor='black')
+        plt.bar(list(histogram), list(histogram.values()), width=0.9, edgecolor='black')
         plt.title(f'{score.replace("_", " ").title()} Distribution')
         plt.xlabel('Score')
         plt.ylabel('Count')
         plt.savefig(f'{score}_hist.png')
         plt.show()
         plt.figure(figsize=(6, 4))
-        df[score].dropna().astype(int).plot.box()
+        plt.gca().bxp([box_stats(histogram, score)], showmeans=False)
         plt.title(f'{score.replace("_", " ").title()} Boxplot')
         plt.savefig(f'{score}_box.png')
         plt.show()
         logging.info(f'Plotted and saved {score} histogram and boxplot.')
 
 if __name__ == "__main__":
-    visualize_scores() 
\ No newline at end of file
+    visualize_scores()